@@ -0,0 +1,198 @@
+"""
+Adherence history: what each day's plan said, kept in SQLite (``/api/timeline``).
+
+Whenever a new plan text is published, the days it covers are written to a
+local database as per-day aggregates (calorie target, calories planned, the
+number of entries and the version in effect) together with the consumption
+curve, the running calorie total at every minute something was due. Months
+of history are then one indexed range query rather than a re-parse of every
+old version.
+
+A day belongs to the plan that was current on it. Publishing a new text
+first fills in the days since the last record with the plan it replaces,
+then rewrites today. Today and later days are worked out from the current
+plan when they are asked for.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import date
+
+# Longest span /api/timeline answers, and the most days one publish fills in
+MAX_DAYS = 1000
+
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS versions (
+    plan TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    published REAL NOT NULL,
+    hash TEXT NOT NULL,
+    target INTEGER,
+    PRIMARY KEY (plan, version)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS days (
+    plan TEXT NOT NULL,
+    day TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    target INTEGER,
+    planned INTEGER NOT NULL,
+    entries INTEGER NOT NULL,
+    PRIMARY KEY (plan, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS curve (
+    plan TEXT NOT NULL,
+    day TEXT NOT NULL,
+    minute INTEGER NOT NULL,
+    consumed INTEGER NOT NULL,
+    PRIMARY KEY (plan, day, minute)
+) WITHOUT ROWID;
+"""
+
+
+def iso(day):
+    return date.fromordinal(day).isoformat()
+
+
+def parse_day(value, default):
+    """A YYYY-MM-DD query parameter as a date; ValueError if malformed."""
+    if not value:
+        return default
+    return date.fromisoformat(value)
+
+
+def day_summary(plan, day):
+    """(planned calories, entry count, curve) for `day` of `plan`; the curve is [minute, running total] pairs."""
+    curve = []
+    total = count = 0
+    for minute, entry in plan.timeline.occurrences(day, -1):
+        total += entry.calories
+        count += 1
+        if curve and curve[-1][0] == minute:
+            curve[-1][1] = total
+        else:
+            curve.append([minute, total])
+    return total, count, curve
+
+
+class AdherenceLog:
+    """The database, with one connection per thread and a thread of its own for writes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.queue = queue.Queue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+
+    def connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = self.local.db = sqlite3.connect(self.path, timeout=30)
+            db.executescript(SCHEMA)
+        return db
+
+    # --- WRITING ---
+
+    def record(self, name, previous, plan):
+        """Queue a newly published plan; `previous` is the one it replaces, if any.
+
+        Called with the store's lock held, so the database work is left to a
+        background thread.
+        """
+        self.queue.put((name or '', previous, plan, time.time()))
+        if self.writer is None:
+            with self.writer_lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self.write_loop, name='adherence', daemon=True)
+                    self.writer.start()
+
+    def write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get())
+            try:
+                self.write(batch)
+            except sqlite3.Error as e:
+                print("Error recording adherence history in {}: {}".format(self.path, e))
+
+    def write(self, batch):
+        """Record queued publishes. A burst of saves to one plan rewrites its days once."""
+        latest = {}
+        db = self.connect()
+        with db:
+            for key, previous, plan, published in batch:
+                db.execute('INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?)',
+                           (key, plan.text_version, published, plan.hash, plan.calorie_target))
+                # The days before the burst still belong to the plan it started from
+                if key in latest:
+                    previous = latest[key][0]
+                latest[key] = (previous, plan, published)
+
+            for key, (previous, plan, published) in latest.items():
+                today = date.fromtimestamp(published).toordinal()
+                last, = db.execute('SELECT max(day) FROM days WHERE plan = ?', (key,)).fetchone()
+                start = date.fromisoformat(last).toordinal() + 1 if last else today
+                for day in range(max(start, today - MAX_DAYS), today):
+                    self.write_day(db, key, day, previous or plan)
+                self.write_day(db, key, today, plan)
+
+    def write_day(self, db, key, day, plan):
+        planned, count, curve = day_summary(plan, day)
+        db.execute('INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?, ?, ?)',
+                   (key, iso(day), plan.text_version, plan.calorie_target, planned, count))
+        db.execute('DELETE FROM curve WHERE plan = ? AND day = ?', (key, iso(day)))
+        db.executemany('INSERT INTO curve VALUES (?, ?, ?, ?)',
+                       ((key, iso(day), minute, consumed) for minute, consumed in curve))
+
+    # --- READING ---
+
+    def days(self, name, plan, first, last, now, with_curve=False):
+        """Consumed against target for each day from `first` to `last` (ordinals).
+
+        Recorded days come from the database; days nothing has been recorded
+        for yet, today and later ones from `plan`. Days before the first
+        record are left out.
+        """
+        key = name or ''
+        today, minute = now.toordinal(), now.hour * 60 + now.minute
+        db = self.connect()
+        recorded, = db.execute('SELECT max(day) FROM days WHERE plan = ?', (key,)).fetchone()
+        stored_until = min(date.fromisoformat(recorded).toordinal() + 1, today) if recorded else today
+        span = (key, iso(first), iso(min(last + 1, stored_until)))
+
+        result = []
+        for day, version, target, planned, entries in db.execute(
+                'SELECT day, version, target, planned, entries FROM days'
+                ' WHERE plan = ? AND day >= ? AND day < ? ORDER BY day', span):
+            result.append({'date': day, 'version': version, 'target': target, 'planned': planned,
+                           'consumed': planned, 'entries': entries})
+        if with_curve and result:
+            curves = {}
+            for day, point, consumed in db.execute(
+                    'SELECT day, minute, consumed FROM curve'
+                    ' WHERE plan = ? AND day >= ? AND day < ? ORDER BY day, minute', span):
+                curves.setdefault(day, []).append([point, consumed])
+            for summary in result:
+                summary['curve'] = curves.get(summary['date'], [])
+
+        for day in range(max(first, stored_until), last + 1):
+            planned, count, curve = day_summary(plan, day)
+            if day < today:
+                consumed = planned
+            elif day == today:
+                consumed = plan.timeline.consumed(day, minute)
+            else:
+                consumed = 0
+            summary = {'date': iso(day), 'version': plan.text_version, 'target': plan.calorie_target,
+                       'planned': planned, 'consumed': consumed, 'entries': count}
+            if with_curve:
+                summary['curve'] = curve
+            result.append(summary)
+        return result
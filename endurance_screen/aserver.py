@@ -0,0 +1,357 @@
+"""
+Asyncio engine for endure-server (``endure-server --async``).
+
+Idle screens spend nearly all their time parked in /api/poll or /api/stream.
+Here each one waits on an asyncio future instead of holding an OS thread, so
+thousands of waiting displays cost a few KB each. Every other route is handed
+to the Flask app unchanged, which keeps the HTTP contract identical to
+threaded mode. The app runs on the loop's thread pool, so a slow save or
+import doesn't hold up the screens, and request bodies are spooled to a
+temporary file as they arrive rather than gathered in memory.
+"""
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from email.utils import formatdate
+from urllib.parse import unquote, parse_qs
+
+from . import main as server
+from . import profiling
+
+MAX_HEADER_BYTES = 64 * 1024
+# Request bodies larger than this go to disk while they're read
+SPOOL_BYTES = 1024 * 1024
+READ_BYTES = 64 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 503: 'Service Unavailable'}
+
+STREAM_HEAD = (b'HTTP/1.1 200 OK\r\n'
+               b'Content-Type: text/event-stream\r\n'
+               b'Cache-Control: no-cache\r\n'
+               b'Connection: close\r\n\r\n')
+
+
+class Waiters:
+    """Futures for parked pollers, resolved together when the plan changes."""
+
+    def __init__(self, loop, store):
+        self.loop = loop
+        self.store = store
+        self.futures = set()
+
+    def add(self):
+        future = self.loop.create_future()
+        self.futures.add(future)
+        # Counted on the store so its notify() sees threaded and async waiters alike
+        with self.store.condition:
+            self.store.waiting += 1
+        server.PARKED_WAITERS.inc()
+        return future
+
+    def discard(self, future):
+        self.futures.discard(future)
+        with self.store.condition:
+            self.store.waiting -= 1
+        server.PARKED_WAITERS.dec()
+
+    def wake(self):
+        futures, self.futures = self.futures, set()
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    def wake_threadsafe(self):
+        # Writes can come from the watcher thread as well as the loop itself
+        self.loop.call_soon_threadsafe(self.wake)
+
+
+class WaiterSets:
+    """One Waiters per plan, hooked into the plan's store on first use."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.sets = {}
+
+    def get(self, store):
+        waiters = self.sets.get(store.name)
+        if waiters is None:
+            waiters = self.sets[store.name] = Waiters(self.loop, store)
+            store.listeners.append(waiters.wake_threadsafe)
+        return waiters
+
+
+async def read_request(reader):
+    """Read one request. Returns (method, target, version, headers, body) or None at EOF.
+
+    `body` is a file positioned at the start of the request body.
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError('headers too large')
+
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length') or 0)
+    if length < 0:
+        raise ValueError('bad content length')
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    try:
+        while length:
+            chunk = await reader.read(min(length, READ_BYTES))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', length)
+            body.write(chunk)
+            length -= len(chunk)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return method, target, version, headers, body
+
+
+def wsgi_environ(method, target, version, headers, body, peer):
+    path, _, query = target.partition('?')
+    host, port = (peer or ('', 0))[:2]
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(path, 'latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'endure',
+        'SERVER_PORT': '0',
+        'SERVER_PROTOCOL': version,
+        'REMOTE_ADDR': host,
+        'REMOTE_PORT': str(port),
+        'CONTENT_TYPE': headers.get('content-type', ''),
+        'CONTENT_LENGTH': headers.get('content-length', '0'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers.items():
+        if name in ('content-type', 'content-length'):
+            continue
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    return environ
+
+
+def call_wsgi(environ):
+    """Run the Flask app for one request and collect the whole response."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = headers
+
+    result = server.app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+def load_store(name):
+    """The plan's store with its plan loaded. Run off the loop: a first load reads the file or asks the hub."""
+    store = server.get_store(name)
+    if store is not None:
+        store.get()
+    return store
+
+
+def encode_response(status, headers, body, keep_alive, head=False):
+    names = {name.lower() for name, _ in headers}
+    headers = list(headers)
+    if 'content-length' not in names:
+        headers.append(('Content-Length', str(len(body))))
+    if 'date' not in names:
+        # Screens set their clock from it
+        headers.append(('Date', formatdate(usegmt=True)))
+    headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+    lines = ['HTTP/1.1 ' + status] + ['{}: {}'.format(k, v) for k, v in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (b'' if head else body)
+
+
+def json_response(code, data):
+    body = json.dumps(data).encode('utf-8')
+    return '{} {}'.format(code, REASONS[code]), [('Content-Type', 'application/json')], body
+
+
+async def api_poll(store, waiters, query, headers, peer, park=True):
+    params = parse_qs(query)
+    client_version = server.parse_version(params.get('version', [None])[0])
+    client_hash = params.get('hash', [None])[0]
+    timeout = server.poll_timeout(params.get('timeout', [None])[0])
+
+    plan = store.get()
+    screen = server.SCREENS.connect(params.get('client', [None])[0], store.name, peer[0] if peer else None,
+                                    headers.get('user-agent'), client_version, store.notified)
+    parked = None
+    try:
+        if not server.is_current(plan, client_version, client_hash):
+            server.POLL_RESULTS['immediate'].inc()
+            return json_response(200, server.poll_reply(plan, True))
+        if not park:
+            return json_response(200, server.poll_reply(plan, False))
+
+        started = time.monotonic()
+        future = waiters.add()
+        try:
+            with profiling.phase('wait'):
+                await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters.discard(future)
+        parked = time.monotonic() - started
+
+        plan = store.get()
+        if not server.is_current(plan, client_version, client_hash):
+            server.POLL_RESULTS['changed'].inc()
+            return json_response(200, server.poll_reply(plan, True))
+        server.POLL_RESULTS['timeout'].inc()
+        return json_response(200, server.poll_reply(plan, False))
+    finally:
+        server.SCREENS.disconnect(screen, parked)
+
+
+async def api_stream(store, waiters, writer, headers, query, peer):
+    """Hold the connection open and write an SSE event for every new plan."""
+    params = parse_qs(query)
+    sent = server.parse_version(headers.get('last-event-id') or params.get('version', [None])[0])
+    screen = server.SCREENS.connect(params.get('client', [None])[0], store.name, peer[0] if peer else None,
+                                    headers.get('user-agent'), sent, store.notified, 'last-event-id' in headers)
+    try:
+        await stream_events(store, waiters, writer, sent, screen)
+    finally:
+        server.SCREENS.disconnect(screen)
+
+
+async def stream_events(store, waiters, writer, sent, screen):
+    writer.write(STREAM_HEAD + b'retry: 5000\n\n')
+    while True:
+        plan = store.get()
+        if plan.version != sent:
+            sent = plan.version
+            writer.write(server.sse_event(server.timed_state(plan)).encode('utf-8'))
+            await writer.drain()
+            server.SCREENS.seen(screen, sent, store.notified)
+        else:
+            writer.write(b': keepalive\n\n')
+            await writer.drain()
+
+        if store.get().version == sent:
+            future = waiters.add()
+            try:
+                await asyncio.wait_for(future, server.STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiters.discard(future)
+
+
+async def handle_connection(waiter_sets, reader, writer):
+    loop = asyncio.get_running_loop()
+    peer = writer.get_extra_info('peername')
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, UnicodeDecodeError):
+                writer.write(encode_response(*json_response(400, {'error': 'Bad request'}), False))
+                break
+            if request is None:
+                break
+
+            method, target, version, headers, body = request
+            connection = headers.get('connection', '').lower()
+            keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+            head = method == 'HEAD'
+
+            path, _, query = target.partition('?')
+            name, route = server.split_plan_path(path)
+            store = unavailable = None
+            if method in ('GET', 'HEAD') and route in ('/api/poll', '/api/stream'):
+                store = server.stores.get(name)
+                if store is None or store._plan is None:
+                    try:
+                        store = await loop.run_in_executor(None, load_store, name)
+                    except (OSError, ValueError, RuntimeError) as e:
+                        # E.g. a replica whose primary is away, which the app's routes answer 503 too
+                        store, unavailable = None, e
+            if store is not None:
+                server.REQUESTS.inc()
+            if store is not None and route == '/api/stream':
+                body.close()
+                if head:
+                    writer.write(STREAM_HEAD)
+                else:
+                    await api_stream(store, waiter_sets.get(store), writer, headers, query, peer)
+                break
+            if unavailable is not None:
+                body.close()
+                status, response_headers, response_body = json_response(503, {'error': str(unavailable)})
+            elif store is not None and route == '/api/poll':
+                body.close()
+                if profiling.ENABLED:
+                    # Not cProfiled: the profiler would also see every coroutine that runs during the wait
+                    profiling.begin(method + ' ' + path, profile=False)
+                # A HEAD poll is answered straight away: there's no body to wait for
+                status, response_headers, response_body = await api_poll(store, waiter_sets.get(store), query,
+                                                                         headers, peer, park=not head)
+                timing = profiling.end()
+                if timing:
+                    response_headers.append(('Server-Timing', timing))
+            else:
+                environ = wsgi_environ(method, target, version, headers, body, peer)
+                try:
+                    status, response_headers, response_body = await loop.run_in_executor(None, call_wsgi, environ)
+                finally:
+                    body.close()
+
+            writer.write(encode_response(status, response_headers, response_body, keep_alive, head))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run(host, port, sock=None):
+    waiter_sets = WaiterSets(asyncio.get_running_loop())
+
+    async def on_connect(reader, writer):
+        await handle_connection(waiter_sets, reader, writer)
+
+    if sock is not None:
+        listener = await asyncio.start_server(on_connect, sock=sock, limit=MAX_HEADER_BYTES)
+    else:
+        listener = await asyncio.start_server(on_connect, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+    async with listener:
+        await listener.serve_forever()
+
+
+def serve(host, port, sock=None):
+    try:
+        asyncio.run(run(host, port, sock))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,369 @@
+"""
+Load generator for endure-server (``endure-bench``).
+
+Starts a server (or targets --url), parks N virtual screens on /api/poll,
+pushes writes through /api/reminders at a fixed rate and then hammers / for
+a while. The report is written as JSON so runs can be compared between
+commits and server options:
+
+- write-to-screen latency percentiles
+- requests per second for /
+- server threads and RSS per connected screen
+- server CPU per poll cycle
+
+Process figures come from /proc and are only available on Linux when the
+bench started the server itself.
+
+``endure-bench --startup`` instead times the ``endure`` CLI (``--help``,
+``--web`` and a fetch/edit/push round trip) and exits non-zero if any
+median exceeds its budget, so slow imports are caught.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+class Connection:
+    """A minimal keep-alive HTTP/1.1 client; enough for the server's responses."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, data=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        head = '{} {} HTTP/1.1\r\nHost: bench\r\nContent-Length: {}\r\n'.format(method, path, len(body))
+        if data is not None:
+            head += 'Content-Type: application/json\r\n'
+        self.writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        response = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+    return {'count': len(values), 'p50': rank(50), 'p90': rank(90), 'p99': rank(99), 'max': values[-1]}
+
+
+# --- SERVER PROCESS STATS ---
+
+def process_tree(pid):
+    """`pid` plus its direct children (the workers in --workers mode)."""
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(entry))
+    return pids
+
+
+def sample_process(pid):
+    """RSS (KB), thread count and CPU seconds for the server, or None off Linux."""
+    if pid is None or not os.path.exists('/proc/{}'.format(pid)):
+        return None
+    rss_kb = threads = 0
+    cpu_ticks = 0
+    for p in process_tree(pid):
+        try:
+            with open('/proc/{}/status'.format(p)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss_kb += int(line.split()[1])
+                    elif line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+            with open('/proc/{}/stat'.format(p)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu_ticks += int(fields[11]) + int(fields[12])
+        except OSError:
+            continue
+    return {'rss_kb': rss_kb, 'threads': threads, 'cpu_seconds': cpu_ticks / os.sysconf('SC_CLK_TCK')}
+
+
+def start_server(port, server_args, workdir):
+    command = [sys.executable, '-c', 'from endurance_screen.main import main; main()',
+               '--host', '127.0.0.1', '--port', str(port)] + shlex.split(server_args)
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:{}'.format(port)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + '/api/reminders', timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server did not start: {}'.format(' '.join(command)))
+
+
+# --- LOAD ---
+
+class Run:
+    def __init__(self, host, port, base):
+        self.host = host
+        self.port = port
+        self.base = base
+        self.sent = {}        # hash of each written plan -> time it was sent
+        self.latencies = []
+        self.polls = 0
+        self.reloads = 0
+        self.errors = 0
+
+    def connection(self):
+        return Connection(self.host, self.port)
+
+    async def screen(self, version, reload_page):
+        conn = self.connection()
+        try:
+            while True:
+                status, body = await conn.request('GET', '{}/api/poll?version={}'.format(self.base, version))
+                self.polls += 1
+                if status != 200:
+                    self.errors += 1
+                    await asyncio.sleep(1)
+                    continue
+                data = json.loads(body)
+                if not data.get('changed'):
+                    continue
+                sent = self.sent.get(data['hash'])
+                if sent is not None:
+                    self.latencies.append(time.perf_counter() - sent)
+                version = data['version']
+                if reload_page:
+                    await conn.request('GET', self.base + '/')
+                    self.reloads += 1
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            self.errors += 1
+        finally:
+            conn.close()
+
+    async def writer(self, rate, duration, entries):
+        conn = self.connection()
+        deadline = time.perf_counter() + duration
+        count = 0
+        try:
+            while time.perf_counter() < deadline:
+                lines = ['Goal: Benchmark', 'Calorie Target: 2000', '# write {}'.format(count)]
+                lines += ['{:02d}:{:02d} | Item {} ({} kcal)'.format(i // 60 % 24, i % 60, i, i % 500)
+                          for i in range(entries)]
+                content = '\n'.join(lines) + '\n'
+                self.sent[hashlib.md5(content.encode('utf-8')).hexdigest()] = time.perf_counter()
+                await conn.request('POST', self.base + '/api/reminders', {'content': content})
+                count += 1
+                await asyncio.sleep(1.0 / rate)
+        finally:
+            conn.close()
+        return count
+
+    async def pages(self, clients, duration):
+        deadline = time.perf_counter() + duration
+        counts = []
+
+        async def client():
+            conn = self.connection()
+            n = 0
+            try:
+                while time.perf_counter() < deadline:
+                    await conn.request('GET', self.base + '/')
+                    n += 1
+            finally:
+                conn.close()
+            counts.append(n)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(clients)])
+        return sum(counts) / (time.perf_counter() - start)
+
+
+async def bench(args, url, server_pid):
+    parts = urlsplit(url)
+    run = Run(parts.hostname, parts.port or 80, parts.path.rstrip('/'))
+    result = {}
+
+    conn = run.connection()
+    status, body = await conn.request('GET', run.base + '/api/reminders')
+    conn.close()
+    version = json.loads(body)['version']
+
+    idle = sample_process(server_pid)
+    screens = []
+    for i in range(args.screens):
+        screens.append(asyncio.ensure_future(run.screen(version, args.reload)))
+        if i % 100 == 99:
+            await asyncio.sleep(0.05)
+    await asyncio.sleep(args.settle)
+    parked = sample_process(server_pid)
+    if idle and parked and args.screens:
+        result['rss_kb_per_screen'] = (parked['rss_kb'] - idle['rss_kb']) / args.screens
+        result['threads_per_screen'] = (parked['threads'] - idle['threads']) / args.screens
+        result['server_idle'] = idle
+        result['server_parked'] = parked
+
+    polls_before = run.polls
+    writes = await run.writer(args.write_rate, args.duration, args.entries)
+    await asyncio.sleep(args.settle)
+    busy = sample_process(server_pid)
+    poll_cycles = run.polls - polls_before
+    if parked and busy and poll_cycles:
+        result['cpu_ms_per_poll'] = (busy['cpu_seconds'] - parked['cpu_seconds']) * 1000 / poll_cycles
+
+    for task in screens:
+        task.cancel()
+    await asyncio.gather(*screens, return_exceptions=True)
+
+    result['writes'] = writes
+    result['poll_cycles'] = poll_cycles
+    result['reloads'] = run.reloads
+    result['errors'] = run.errors
+    result['notify_latency_ms'] = percentiles([t * 1000 for t in run.latencies])
+    result['index_requests_per_second'] = await run.pages(args.page_clients, args.page_seconds)
+    return result
+
+
+# --- CLI STARTUP ---
+
+# Stands in for $EDITOR: appends a line, so every round trip pushes a change
+EDITOR_SCRIPT = """import sys
+with open(sys.argv[1], 'a') as f:
+    f.write('# endure-bench\\n')
+"""
+
+
+def time_command(command, env, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def startup(args, url, workdir):
+    editor = os.path.join(workdir, 'editor')
+    with open(editor, 'w') as f:
+        f.write('#!{}\n'.format(sys.executable) + EDITOR_SCRIPT)
+    os.chmod(editor, 0o755)
+    # BROWSER=true makes --web run `true` instead of opening anything
+    env = dict(os.environ, EDITOR=editor, BROWSER='true')
+
+    cli = [sys.executable, '-m', 'endurance_screen.endure']
+    budgets = {'help': args.budget_help, 'web': args.budget_web, 'round_trip': args.budget_round_trip}
+    seconds = {
+        'help': time_command(cli + ['--help'], env, args.runs),
+        'web': time_command(cli + [url, '--web'], env, args.runs),
+        'round_trip': time_command(cli + [url], env, args.runs),
+    }
+    return {name: {'median_seconds': seconds[name], 'budget_seconds': budgets[name],
+                   'ok': seconds[name] <= budgets[name]}
+            for name in seconds}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Endure Server load benchmark")
+    parser.add_argument('--url', help='Benchmark a running server instead of starting one (no process stats)')
+    parser.add_argument('--server-args', default='', help='Extra endure-server options, e.g. --server-args="--async"')
+    parser.add_argument('--port', type=int, default=5099, help='Port for the server the bench starts')
+    parser.add_argument('--screens', type=int, default=100, help='Virtual screens long-polling')
+    parser.add_argument('--no-reload', dest='reload', action='store_false',
+                        help="Screens don't fetch / after each change")
+    parser.add_argument('--write-rate', type=float, default=1.0, help='Writes per second')
+    parser.add_argument('--entries', type=int, default=20, help='Reminder lines per written plan')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of writes')
+    parser.add_argument('--settle', type=float, default=2.0, help='Seconds to let connections settle')
+    parser.add_argument('--page-clients', type=int, default=8, help='Concurrent clients loading /')
+    parser.add_argument('--page-seconds', type=float, default=5.0, help='Seconds of loading /')
+    parser.add_argument('--output', default='bench_output.json', help='Where to write the JSON report')
+    parser.add_argument('--startup', action='store_true', help='Time the endure CLI against budgets instead')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per CLI command (--startup)')
+    parser.add_argument('--budget-help', type=float, default=0.15, metavar='SECONDS',
+                        help='Budget for endure --help (--startup)')
+    parser.add_argument('--budget-web', type=float, default=0.25, metavar='SECONDS',
+                        help='Budget for endure --web (--startup)')
+    parser.add_argument('--budget-round-trip', type=float, default=0.4, metavar='SECONDS',
+                        help='Budget for a fetch, edit and push (--startup)')
+    args = parser.parse_args()
+
+    process = None
+    workdir = tempfile.mkdtemp(prefix='endure-bench-')
+    url = args.url
+    if url is None:
+        process, url = start_server(args.port, args.server_args, workdir)
+
+    try:
+        if args.startup:
+            results = startup(args, url, workdir)
+        else:
+            results = asyncio.run(bench(args, url, process.pid if process else None))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'time': time.time(),
+        'revision': git_revision(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print("Report written to {}".format(args.output))
+    if args.startup and not all(result['ok'] for result in results.values()):
+        print("Over budget: {}".format(', '.join(name for name, result in results.items() if not result['ok'])))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Line patches for plan text, and the three-way merge behind patched saves.
+
+A patch is a list of hunks ``[start, end, lines]``: replace lines
+``start:end`` of the base text (0-based, end exclusive) with ``lines``. Lines
+keep their line endings, so applying a patch reproduces the text exactly.
+Hunks are sorted and do not overlap. It is plain JSON, so the CLI can send
+one to /api/reminders instead of the whole plan.
+"""
+import difflib
+
+
+class PatchError(ValueError):
+    """The patch doesn't fit the text it is applied to."""
+
+
+class MergeConflict(Exception):
+    """Both sides changed the same lines; `hunks` are the clashing pairs."""
+
+    def __init__(self, hunks):
+        super().__init__('overlapping edits')
+        self.hunks = hunks
+
+
+def make_patch(old, new):
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [[i1, i2, new_lines[j1:j2]]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+
+def check_patch(patch, line_count):
+    """Validate a patch (possibly from the network) against a text of `line_count` lines."""
+    if not isinstance(patch, list):
+        raise PatchError('patch must be a list of hunks')
+    position = 0
+    for hunk in patch:
+        if not (isinstance(hunk, (list, tuple)) and len(hunk) == 3):
+            raise PatchError('hunks are [start, end, lines]')
+        start, end, lines = hunk
+        if not (isinstance(start, int) and isinstance(end, int) and position <= start <= end <= line_count):
+            raise PatchError('hunk {}:{} is out of order or out of range'.format(start, end))
+        if not (isinstance(lines, list) and all(isinstance(line, str) for line in lines)):
+            raise PatchError('hunk lines must be strings')
+        position = end
+
+
+def apply_patch(text, patch):
+    lines = text.splitlines(keepends=True)
+    check_patch(patch, len(lines))
+    result = []
+    position = 0
+    for start, end, replacement in patch:
+        result.extend(lines[position:start])
+        result.extend(replacement)
+        position = end
+    result.extend(lines[position:])
+    return ''.join(result)
+
+
+def clashes(a, b):
+    """Whether two hunks against the same base touch the same lines."""
+    (s1, e1, _), (s2, e2, _) = a, b
+    if s1 == s2:
+        return True
+    if s1 == e1:
+        return s2 < s1 < e2
+    if s2 == e2:
+        return s1 < s2 < e1
+    return max(s1, s2) < min(e1, e2)
+
+
+def merge(base, current, patch):
+    """Apply `patch` (made against `base`) on top of `current`, which also started from `base`.
+
+    Raises MergeConflict if the two sides edited the same lines, unless they
+    made the identical change.
+    """
+    check_patch(patch, len(base.splitlines(keepends=True)))
+    theirs = make_patch(base, current)
+    ours = [list(hunk) for hunk in patch if list(hunk) not in theirs]
+
+    conflicts = [(a, b) for a in ours for b in theirs if clashes(a, b)]
+    if conflicts:
+        raise MergeConflict(conflicts)
+
+    combined = sorted(ours + theirs, key=lambda hunk: (hunk[0], hunk[1]))
+    return apply_patch(base, combined)
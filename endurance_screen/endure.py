@@ -1,35 +1,43 @@
 #!/usr/bin/env python3
 """
 Endure CLI - Remote file editor with conflict detection
+
+Run from scripts and hotkeys, so startup matters: modules only some paths
+need (the editor, the browser, diffing, sync) are imported where they are used.
 """
 import sys
 import os
-import tempfile
-import subprocess
-import requests
 import argparse
-import webbrowser
+
+from .transport import Client
 
 def get_editor():
     """Get the user's preferred editor"""
     return os.environ.get('EDITOR', 'vim')
 
-def fetch_file(url):
-    """Fetch file content and hash from server"""
+def fetch_file(client, url):
+    """Fetch the plan from the server: its content, hash, version and what the server supports"""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        return data['content'], data['hash']
-    except requests.RequestException as e:
+        status, data = client.get(url, ok=(200, 404))
+        if status == 404 and '/p/' in url:
+            print("There is no such plan yet; saving will create it.")
+            return '', None, None, []
+        if status == 404:
+            print(f"Error fetching file: nothing at {url}", file=sys.stderr)
+            sys.exit(1)
+        return data['content'], data['hash'], data.get('version'), data.get('features', [])
+    except OSError as e:
         print(f"Error fetching file: {e}", file=sys.stderr)
         sys.exit(1)
-    except (KeyError, ValueError) as e:
+    except (KeyError, TypeError, ValueError) as e:
         print(f"Invalid response from server. Did you use the right URL?\nError: {e}", file=sys.stderr)
         sys.exit(1)
 
 def edit_content(content):
     """Open content in editor and return edited version"""
+    import subprocess
+    import tempfile
+
     editor = get_editor()
     
     with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
@@ -44,40 +52,96 @@ def edit_content(content):
     finally:
         os.unlink(temp_path)
 
-def push_file(url, content, file_hash):
-    """Push edited content back to server"""
+def save_rejected(content):
+    """Keep edits the server refused somewhere the user can find them"""
+    import tempfile
+
+    with tempfile.NamedTemporaryFile(mode='w', prefix='endure-', suffix='.txt', delete=False) as f:
+        f.write(content)
+    return f.name
+
+def push_file(client, url, content, file_hash, base=None, version=None, features=()):
+    """Push edited content back to server.
+
+    Servers that take patches get only the changed lines, made against
+    `base` at `version`; they merge them with any save made in between and
+    only refuse edits that overlap it.
+    """
+    if 'patch' in features and base is not None and version is not None:
+        from .delta import make_patch
+        payload = {'patch': make_patch(base, content), 'version': version}
+    else:
+        payload = {'content': content, 'hash': file_hash}
     try:
-        response = requests.post(
-            url,
-            json={'content': content, 'hash': file_hash},
-            headers={'Content-Type': 'application/json'}
-        )
+        status, data = client.post(url, payload, ok=(200, 409))
         
-        if response.status_code == 409:
-            data = response.json()
+        if status == 409:
             print("⚠️  CONFLICT: File has been modified on server", file=sys.stderr)
-            print(f"\nCurrent server content:\n{data['current_content']}", file=sys.stderr)
-            print("\nYour changes were not saved.", file=sys.stderr)
+            if data.get('conflicts'):
+                for ours, theirs in data['conflicts']:
+                    print(f"\nLines {ours[0] + 1}-{max(ours[1], ours[0] + 1)} were also changed on the server to:",
+                          file=sys.stderr)
+                    print(''.join(theirs[2]) or "(deleted)", file=sys.stderr)
+            else:
+                print(f"\nCurrent server content:\n{data['current_content']}", file=sys.stderr)
+            print(f"\nYour changes were not saved. Your version is in {save_rejected(content)}", file=sys.stderr)
             sys.exit(1)
         
-        response.raise_for_status()
-        print("✓ File saved successfully")
+        if data.get('merged'):
+            print("✓ File saved, merged with changes made on the server meanwhile")
+        else:
+            print("✓ File saved successfully")
         return True
         
-    except requests.RequestException as e:
+    except (OSError, ValueError) as e:
         print(f"Error pushing file: {e}", file=sys.stderr)
         sys.exit(1)
 
+def import_file(client, url, path, append=False, skip_invalid=False):
+    """Upload a CSV or iCalendar file whose entries become one new version of the plan"""
+    import_url = url[:-len('/api/reminders')] + '/api/import'
+    is_calendar = path.lower().endswith(('.ics', '.ical', '.ifb'))
+    params = {'mode': 'append' if append else 'replace', 'skip_invalid': 1 if skip_invalid else None}
+    try:
+        with open(path, 'rb') as f:
+            status, data = client.upload(import_url, f, 'text/calendar' if is_calendar else 'text/csv',
+                                         params=params, ok=(200, 400, 409))
+    except (OSError, ValueError) as e:
+        print(f"Error importing file: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if status != 200:
+        print(f"⚠️  {data['error']}", file=sys.stderr)
+        for error in data.get('errors') or []:
+            print(f"  line {error['line']}: {error['error']}", file=sys.stderr)
+        if status == 400 and data.get('errors') and not skip_invalid:
+            print("Nothing was imported. Fix those rows or pass --skip-invalid.", file=sys.stderr)
+        sys.exit(1)
+
+    skipped = f", skipped {data['skipped']} invalid rows" if data.get('skipped') else ""
+    print(f"✓ Imported {data['imported']} entries{skipped}")
+
 def main():
     parser = argparse.ArgumentParser(description="Endure CLI")
     parser.add_argument("url", help="The URL of the endurance server (e.g. http://endure:1024)")
     parser.add_argument("--web", action="store_true", help="Open the web editor in your browser instead of CLI")
+    parser.add_argument("--plan", help="Name of the plan to edit when the server hosts several")
+    parser.add_argument("--sync", metavar="FILE", help="Keep FILE and the plan in two-way sync until interrupted")
+    parser.add_argument("--push-local", action="store_true",
+                        help="With --sync, send FILE's changes to the server even if it differs at the start")
+    commands = parser.add_subparsers(dest="command")
+    importing = commands.add_parser("import", help="Replace the plan's entries with those in a CSV or .ics file")
+    importing.add_argument("file", help="CSV (time, description, calories) or iCalendar file")
+    importing.add_argument("--append", action="store_true", help="Add to the plan's entries instead of replacing them")
+    importing.add_argument("--skip-invalid", action="store_true", help="Import the rows that can be read and skip the rest")
     args = parser.parse_args()
     
     # 1. Clean the base URL
     url = args.url.rstrip('/')
     if not url.startswith(('http://', 'https://')):
         url = 'http://' + url
+    if args.plan:
+        url = f"{url.split('/api/')[0]}/p/{args.plan}"
 
     # 2. Handle Web Mode
     if args.web:
@@ -85,6 +149,7 @@ def main():
         base_url = url.split('/api/')[0]
         web_url = f"{base_url}/edit"
         print(f"Opening web editor at {web_url}...")
+        import webbrowser
         webbrowser.open(web_url)
         sys.exit(0)
 
@@ -92,9 +157,21 @@ def main():
     # Automatically append API endpoint if not present
     if not url.endswith('/api/reminders'):
         url = f"{url}/api/reminders"
+
+    if args.sync:
+        from .sync import sync
+        sync(url, args.sync, push_local=args.push_local)
+        return
+
+    if args.command == "import":
+        print(f"Importing {args.file}...")
+        import_file(Client(url), url, args.file, append=args.append, skip_invalid=args.skip_invalid)
+        return
     
     print(f"Fetching {url}...")
-    content, file_hash = fetch_file(url)
+    # One connection for the fetch and the push
+    client = Client(url)
+    content, file_hash, version, features = fetch_file(client, url)
     
     print(f"Opening in {get_editor()}...")
     edited_content = edit_content(content)
@@ -104,7 +181,7 @@ def main():
         sys.exit(0)
     
     print("Saving changes...")
-    push_file(url, edited_content, file_hash)
+    push_file(client, url, edited_content, file_hash, base=content, version=version, features=features)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,301 @@
+"""
+Bulk import of plan entries from CSV and iCalendar files (``/api/import``).
+
+The upload is read as a stream, a row or event at a time, and converted to
+plan lines in chunks of CHUNK_ROWS. An upload with bad rows is given up on
+at the end of the chunk that found them, rather than after reading it all.
+Memory therefore grows with the plan being built, not with the file: an
+iCalendar export's descriptions, attachments and other components are
+dropped as they stream past.
+
+CSV files with a header row are matched by column name (date, time,
+description, calories and a few synonyms). Without one the columns are
+time, description and calories. Calendar events keep their start time.
+Daily and weekly repeats become the plan's own repeating forms, and a
+bounded weekly repeat is listed out day by day. Those forms apply from today,
+so an endless repeat that only starts later is planned for its first
+MAX_RANGE_DAYS days.
+"""
+import csv
+import io
+import itertools
+import re
+from datetime import date, datetime, timedelta, timezone
+
+from .timeline import MAX_RANGE_DAYS, WEEKDAYS, parse_entry
+
+CHUNK_ROWS = 1000
+# Errors reported back; the rest are only counted
+MAX_ERRORS = 20
+
+FORMATS = {'csv': 'csv', 'text/csv': 'csv', 'ics': 'ics', 'ical': 'ics', 'text/calendar': 'ics'}
+
+CALORIES_RE = re.compile(r'\b\d+\s*k?cal\b', re.IGNORECASE)
+NUMBER_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)')
+
+
+def upload_format(requested, mimetype):
+    """'csv' or 'ics' for ?format= or else the upload's content type; None means sniff it.
+
+    ValueError for a format that was asked for but isn't known.
+    """
+    if requested:
+        if requested.lower() not in FORMATS:
+            raise ValueError('format must be csv or ics')
+        return FORMATS[requested.lower()]
+    return FORMATS.get(mimetype)
+
+
+def read_rows(stream, kind=None):
+    """(line number, when, description, calories, error) for each row of an uploaded binary stream.
+
+    `kind` is 'csv' or 'ics'; without one the stream is sniffed.
+    """
+    buffered = io.BufferedReader(stream)
+    if kind is None:
+        kind = 'ics' if b'BEGIN:VCALENDAR' in buffered.peek(64)[:32].upper() else 'csv'
+    text = io.TextIOWrapper(buffered, encoding='utf-8-sig', errors='replace', newline='')
+    return ics_rows(text) if kind == 'ics' else csv_rows(text)
+
+
+def convert(rows, skip_invalid=False):
+    """Validate rows and turn them into plan lines.
+
+    Returns (lines, invalid row count, the first MAX_ERRORS errors as dicts
+    of line and error). Unless `skip_invalid`, reading stops after the
+    chunk with the first bad row.
+    """
+    lines, errors = [], []
+    invalid = 0
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        for number, when, description, calories, error in chunk:
+            if error is None:
+                description = ' '.join(description.split())
+                if not description:
+                    error = 'no description'
+                elif parse_entry(when, description, 0) is None:
+                    error = "can't read the time {!r}".format(when)
+            if error is not None:
+                invalid += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append({'line': number, 'error': error})
+                continue
+            if calories and not CALORIES_RE.search(description):
+                description = '{} ({} kcal)'.format(description, calories)
+            lines.append('{} | {}'.format(when, description))
+        if invalid and not skip_invalid:
+            break
+    return lines, invalid, errors
+
+
+def calories_in(text):
+    match = NUMBER_RE.match(text or '')
+    return round(float(match.group(1))) if match else None
+
+
+# --- CSV ---
+
+COLUMNS = {
+    'date': ('date', 'day'),
+    'time': ('time', 'start', 'start time', 'when', 'datetime'),
+    'description': ('description', 'name', 'title', 'summary', 'meal', 'food', 'item', 'event'),
+    'calories': ('calories', 'kcal', 'cal', 'energy', 'energy (kcal)', 'calories (kcal)'),
+}
+
+DATETIME_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})[T ](\d{1,2}:\d{2}(?::\d{2})?)$')
+CLOCK_RE = re.compile(r'^(\d{1,2}):(\d{2})(?::\d{2})?\s*([ap])?\.?m?\.?$', re.IGNORECASE)
+
+
+def header_columns(row):
+    """Column positions by field if `row` is a header, else None."""
+    names = [cell.strip().lower() for cell in row]
+    columns = {}
+    for field, synonyms in COLUMNS.items():
+        for position, name in enumerate(names):
+            if name in synonyms:
+                columns[field] = position
+                break
+    if 'time' in columns and 'description' in columns:
+        return columns
+    return None
+
+
+def clock(text):
+    """'8:05 pm', '20:05:00' and the like as HH:MM; anything else unchanged."""
+    match = CLOCK_RE.match(text)
+    if not match:
+        return text
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if match.group(3):
+        hour = hour % 12 + (12 if match.group(3).lower() == 'p' else 0)
+    return '{:02d}:{:02d}'.format(hour, minute)
+
+
+def csv_rows(lines):
+    reader = csv.reader(lines)
+    columns = None
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if columns is None:
+            columns = header_columns(row)
+            if columns is not None:
+                continue
+            columns = {'time': 0, 'description': 1, 'calories': 2}
+
+        def cell(field):
+            position = columns.get(field)
+            return row[position].strip() if position is not None and position < len(row) else ''
+
+        day, when = cell('date'), cell('time')
+        match = DATETIME_RE.match(when)
+        if match:
+            day, when = match.groups()
+        when = clock(when)
+        if day:
+            when = '{} {}'.format(day, when)
+        calories = cell('calories')
+        if calories and calories_in(calories) is None:
+            yield reader.line_num, when, '', None, 'calories {!r} is not a number'.format(calories)
+            continue
+        yield reader.line_num, when, cell('description'), calories_in(calories), None
+
+
+# --- ICALENDAR ---
+
+ICS_DAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+
+
+def unfold(lines):
+    """Join folded iCalendar content lines, numbered by the line each starts on."""
+    current, start = None, 0
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current is not None:
+        yield start, current
+
+
+def ics_text(value):
+    return re.sub(r'\\([\\;,nN])', lambda m: ' ' if m.group(1) in 'nN' else m.group(1), value)
+
+
+def ics_datetime(params, value):
+    """A DTSTART as local naive time, or None for an all-day date."""
+    if params.get('VALUE', '').upper() == 'DATE' or 'T' not in value:
+        return None
+    utc = value.endswith('Z')
+    start = datetime.strptime(value.rstrip('Z')[:15], '%Y%m%dT%H%M%S')
+    if utc:
+        return start.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    if 'TZID' in params:
+        try:
+            from zoneinfo import ZoneInfo
+            zone = ZoneInfo(params['TZID'].strip('"'))
+        except (ImportError, ValueError, KeyError, OSError):
+            return start  # unknown zone: take the wall time as ours
+        return start.replace(tzinfo=zone).astimezone().replace(tzinfo=None)
+    return start
+
+
+def ics_until(rule):
+    until = rule.get('UNTIL')
+    if until is None:
+        return None
+    return datetime.strptime(until[:8], '%Y%m%d').date()
+
+
+def ics_rows(lines):
+    event = None
+    for number, line in unfold(lines):
+        head, _, value = line.partition(':')
+        name, *params = head.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event = {'line': number}
+        elif event is None:
+            continue
+        elif name == 'END' and value.upper() == 'VEVENT':
+            yield from event_rows(event)
+            event = None
+        elif name in ('DTSTART', 'SUMMARY', 'DESCRIPTION', 'RRULE'):
+            event[name] = (dict(param.split('=', 1) for param in params if '=' in param), value)
+
+
+def event_rows(event):
+    number = event['line']
+    if 'DTSTART' not in event:
+        yield number, '', '', None, 'event has no start'
+        return
+    try:
+        start = ics_datetime(*event['DTSTART'])
+    except ValueError:
+        start = None
+    if start is None:
+        yield number, '', '', None, 'all-day events have no time of day'
+        return
+
+    summary = ics_text(event.get('SUMMARY', ({}, ''))[1])
+    details = ics_text(event.get('DESCRIPTION', ({}, ''))[1])
+    match = CALORIES_RE.search(details)
+    calories = calories_in(match.group(0)) if match else None
+    time_str = start.strftime('%H:%M')
+    first = start.date()
+
+    rule = {}
+    if 'RRULE' in event:
+        rule = dict(part.split('=', 1) for part in event['RRULE'][1].upper().split(';') if '=' in part)
+    frequency = rule.get('FREQ')
+    if rule.get('INTERVAL', '1') != '1' or frequency not in (None, 'DAILY', 'WEEKLY'):
+        yield number, '', '', None, 'repeat rule {} is not supported'.format(event['RRULE'][1])
+        return
+
+    if frequency is None:
+        yield number, '{} {}'.format(first, time_str), summary, calories, None
+        return
+
+    try:
+        last = ics_until(rule)
+    except ValueError:
+        yield number, '', '', None, 'repeat end {} is not a date'.format(rule['UNTIL'])
+        return
+    count = int(rule['COUNT']) if rule.get('COUNT', '').isdigit() else None
+    endless = last is None and count is None
+    if endless and first > date.today():
+        last = first + timedelta(days=MAX_RANGE_DAYS - 1)
+        endless = False
+    if frequency == 'DAILY':
+        if count is not None:
+            last = first + timedelta(days=count - 1)
+        when = time_str if endless else '{}..{} {}'.format(first, last, time_str)
+        yield number, when, summary, calories, None
+        return
+
+    weekdays = sorted({ICS_DAYS[day[-2:]] for day in rule.get('BYDAY', '').split(',') if day[-2:] in ICS_DAYS}
+                      or {first.weekday()})
+    if endless:
+        when = '{} {}'.format(','.join(WEEKDAYS[day].title() for day in weekdays), time_str)
+        yield number, when, summary, calories, None
+        return
+    # The plan has no bounded weekly form, so list the days out
+    if last is None:
+        last = first + timedelta(days=MAX_RANGE_DAYS)
+    if (last - first).days > MAX_RANGE_DAYS:
+        yield number, '', '', None, 'weekly repeat runs more than {} days'.format(MAX_RANGE_DAYS)
+        return
+    for ordinal in range(first.toordinal(), last.toordinal() + 1):
+        day = date.fromordinal(ordinal)
+        if day.weekday() in weekdays:
+            yield number, '{} {}'.format(day, time_str), summary, calories, None
+            if count is not None:
+                count -= 1
+                if not count:
+                    return
@@ -1,19 +1,32 @@
-from flask import Flask, render_template_string, request, redirect, url_for, jsonify
-from datetime import datetime
+from flask import Flask, Response, abort, make_response, request, redirect, url_for, jsonify
+from datetime import datetime, timedelta, timezone
 import os
+import bisect
+import copy
+import stat
+import tempfile
 import hashlib
+import gzip
+import itertools
+import json
 import argparse
 import time
 import threading
 import re
 
+from . import adherence, delta, importer, metrics, profiling, screens
+from .timeline import Timeline, occurrence_label, occurrence_time, parse_entry
+
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 
 REMINDERS_FILE = 'reminders.txt'
+DISPLAY_COUNT = 3
+STREAM_KEEPALIVE = 15
+POLL_TIMEOUT = 30
+# Low-power screens park a single poll until something actually happens
+MAX_POLL_TIMEOUT = 3600
 
-# Global synchronization primitive
-update_condition = threading.Condition()
 
 # --- IN-EDITOR DOCUMENTATION ---
 DEFAULT_CONTENT = """# ENDURANCE HUD INSTRUCTIONS
@@ -29,6 +42,10 @@ DEFAULT_CONTENT = """# ENDURANCE HUD INSTRUCTIONS
 #    
 #    * Past items count towards "Consumed" total.
 #    * Future items wait in the list.
+#    * HH:MM repeats every day. Qualify it for other days:
+#        2026-10-18 08:00              that day only
+#        2026-10-18..2026-10-24 08:00  every day in the range
+#        Mon,Thu 08:00                 every Monday and Thursday
 #
 # ==========================================
 # EXAMPLE:
@@ -41,260 +58,397 @@ DEFAULT_CONTENT = """# ENDURANCE HUD INSTRUCTIONS
 # 12:00 | Bone Broth (50 kcal)
 """
 
-# --- HARDCODED TEMPLATES ---
+# --- STATIC ASSETS ---
 
-HTML_INDEX = """
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Endurance Screen</title>
-    <meta http-equiv="refresh" content="300">
-    <script>
-        var currentHash = "{{ page_hash }}";
-        var nextTargetStr = "{{ next_target }}"; // ISO string from server
-        
-        function setStatus(status) {
-            var el = document.getElementById('status-dot');
-            if (status === 'connected') {
-                el.className = 'status connected';
+# Served from /assets/ under content-hashed names, so screens cache them for good
+# and only the dynamic markup travels on each reload
+SCREEN_JS = """
+function setStatus(status) {
+    var el = document.getElementById('status-dot');
+    if (status === 'connected') {
+        el.className = 'status connected';
+    } else {
+        el.className = 'status disconnected';
+    }
+}
+
+function makeRequest(method, url, callback, errorCallback) {
+    var xhr = new XMLHttpRequest();
+    xhr.open(method, url, true);
+    xhr.onreadystatechange = function() {
+        if (xhr.readyState === 4) {
+            if (xhr.status === 200) {
+                try {
+                    var data = JSON.parse(xhr.responseText);
+                    callback(data, xhr);
+                } catch (e) {
+                    errorCallback(e);
+                }
+            } else if (xhr.status === 502) {
+                // Server timeout, retry after delay
+                setTimeout(function() {
+                    waitForUpdate();
+                }, 1000);
             } else {
-                el.className = 'status disconnected';
+                errorCallback(new Error('Request failed'));
             }
         }
+    };
+    xhr.send();
+}
 
-        function makeRequest(method, url, callback, errorCallback) {
-            var xhr = new XMLHttpRequest();
-            xhr.open(method, url, true);
-            xhr.onreadystatechange = function() {
-                if (xhr.readyState === 4) {
-                    if (xhr.status === 200) {
-                        try {
-                            var data = JSON.parse(xhr.responseText);
-                            callback(data);
-                        } catch (e) {
-                            errorCallback(e);
-                        }
-                    } else if (xhr.status === 502) {
-                        // Server timeout, retry after delay
-                        setTimeout(function() {
-                            waitForUpdate();
-                        }, 1000);
-                    } else {
-                        errorCallback(new Error('Request failed'));
-                    }
-                }
-            };
-            xhr.send();
+function fetchState(callback) {
+    makeRequest('GET', baseUrl + '/api/state',
+        function(state, xhr) {
+            // The body may be the browser's cached copy, but every 304 refreshes its Date
+            var date = Date.parse(xhr.getResponseHeader('Date'));
+            if (date) clockOffset = date + 500 - new Date().getTime();
+            renderState(state);
+            if (callback) callback();
+        },
+        function(error) {
+            setStatus('disconnected');
+            if (callback) setTimeout(callback, 5000);
         }
+    );
+}
 
-        function waitForUpdate() {
-            setStatus('connected');
-            makeRequest('GET', '/api/poll?hash=' + currentHash, 
-                function(data) {
-                    if (data.changed) {
-                        window.location.reload();
-                    } else {
-                        waitForUpdate();
-                    }
-                },
-                function(error) {
-                    setStatus('disconnected');
-                    setTimeout(waitForUpdate, 5000);
-                }
-            );
+// LOW POWER: one long poll per real change, backing off on errors but
+// never sleeping past the next time the plan changes by itself
+var retryDelay = 5000;
+
+function retryLater() {
+    setStatus('disconnected');
+    var delay = retryDelay;
+    if (lowPower) {
+        retryDelay = Math.min(retryDelay * 2, 300000);
+        var untilChange = nextChange * 1000 - (new Date().getTime() + clockOffset);
+        delay = Math.max(5000, Math.min(delay, untilChange));
+    }
+    setTimeout(waitForUpdate, delay);
+}
+
+function waitForUpdate() {
+    setStatus('connected');
+    var timeout = lowPower ? 3600 : 30;
+    makeRequest('GET', baseUrl + '/api/poll?version=' + currentVersion + '&timeout=' + timeout +
+                '&client=' + screenId,
+        function(data) {
+            retryDelay = 5000;
+            if (data.next_change) nextChange = data.next_change;
+            if (data.server_time) clockOffset = data.server_time * 1000 - new Date().getTime();
+            if (data.changed) {
+                // Fetch the small JSON state rather than reloading the page
+                fetchState(waitForUpdate);
+            } else {
+                waitForUpdate();
+            }
+        },
+        function(error) {
+            retryLater();
         }
+    );
+}
 
-        // T-MINUS COUNTDOWN LOGIC (Updates every 60s)
-        function updateCountdown() {
-            if (!nextTargetStr || nextTargetStr === 'None') return;
+// Random id the server's /api/screens knows this screen by, kept across reloads
+var screenId = (function() {
+    var id = null;
+    try {
+        id = window.localStorage.getItem('endureScreen');
+    } catch (e) {}
+    if (!id) {
+        id = '';
+        for (var i = 0; i < 16; i++) {
+            id += 'abcdefghijklmnopqrstuvwxyz0123456789'.charAt(Math.floor(Math.random() * 36));
+        }
+        try {
+            window.localStorage.setItem('endureScreen', id);
+        } catch (e) {}
+    }
+    return id;
+})();
 
-            var target = new Date(nextTargetStr);
-            var now = new Date();
-            var diff = target - now;
+// Server clock minus ours, so countdowns are right on tablets with a wrong clock
+var clockOffset = 0;
 
-            var el = document.getElementById('countdown-display');
-            if (!el) return;
+// STREAMED UPDATES: patch the page in place instead of reloading
+function escapeHtml(text) {
+    return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+}
 
-            if (diff <= 0) {
-                el.innerHTML = "NOW";
-                el.className = "countdown blinking";
-                return;
-            }
+function renderState(state) {
+    currentVersion = state.version;
+    nextTargetStr = state.next_target || 'None';
+    nextChange = state.next_change;
+    if (state.server_time) {
+        clockOffset = state.server_time * 1000 - new Date().getTime();
+    }
 
-            var totalMinutes = Math.floor(diff / (1000 * 60));
-            var hours = Math.floor(totalMinutes / 60);
-            var minutes = totalMinutes % 60;
+    var headerHtml = '';
+    if (state.goal) headerHtml += '<div class="goal">' + escapeHtml(state.goal) + '</div>';
+    if (state.reason) headerHtml += '<div class="reason">' + escapeHtml(state.reason) + '</div>';
+    if (state.calorie_target) {
+        var percent = Math.round(state.calories_eaten / state.calorie_target * 100);
+        var warning = state.calories_eaten > state.calorie_target ? ' warning' : '';
+        headerHtml += '<div class="cal-container">' +
+            '<div class="cal-text">' + state.calories_eaten + ' / ' + state.calorie_target + ' kcal</div>' +
+            '<div class="cal-bar-bg"><div class="cal-bar-fill' + warning + '" style="width: ' + percent + '%;"></div></div>' +
+            '</div>';
+    }
+    document.getElementById('header-content').innerHTML = headerHtml;
+    document.getElementById('header').style.display = headerHtml ? '' : 'none';
 
-            // Format: "T- 1h 45m" or just "T- 45m" if less than an hour
-            var timeText;
-            if (hours > 0) {
-                timeText = "T- " + hours + "h " + minutes + "m";
-            } else {
-                timeText = "T- " + minutes + "m";
-            }
-            el.innerHTML = timeText;
-            
-            // Blink if less than 5 minutes
-            if (hours === 0 && minutes < 5) {
-                el.className = "countdown blinking";
-            } else {
-                el.className = "countdown";
-            }
+    var html = '';
+    if (state.reminders.length) {
+        for (var i = 0; i < state.reminders.length; i++) {
+            var r = state.reminders[i];
+            html += '<div class="reminder">' +
+                '<span class="time">' + escapeHtml(r.time_str) + '</span>' +
+                '<span class="desc">' + escapeHtml(r.description) + '</span>' +
+                (i === 0 ? '<span id="countdown-display" class="countdown"></span>' : '') +
+                '</div>';
         }
+    } else {
+        html = '<div class="empty">Nothing to endure right now.</div>';
+    }
+    if (state.remaining_count > 0) {
+        html += '<div class="more">+ ' + state.remaining_count + ' more items later</div>';
+    }
+    document.getElementById('content-cell').innerHTML = html;
 
-        function onWindowLoad() {
-            waitForUpdate();
-            
-            // Align the update to the start of the next minute for precision
-            var now = new Date();
-            var secondsUntilNextMinute = 60 - now.getSeconds();
-            
-            updateCountdown(); // Run immediately on load
-            
-            setTimeout(function() {
-                updateCountdown();
-                setInterval(updateCountdown, 60000); // Run every 60s thereafter
-            }, secondsUntilNextMinute * 1000);
-        }
+    updateCountdown();
+}
 
-        // Cross-browser event listener
-        if (window.addEventListener) {
-            window.addEventListener('load', onWindowLoad, false);
-        } else if (window.attachEvent) {
-            window.attachEvent('onload', onWindowLoad);
-        } else {
-            window.onload = onWindowLoad;
-        }
-    </script>
-    <style>
-        body { 
-            background: #000; 
-            color: #fff; 
-            font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; 
-            text-align: center; 
-            margin: 0; 
-            padding: 20px; 
-        }
-        
-        .container {
-            display: table;
-            width: 100%;
-            height: 95vh;
-            table-layout: fixed;
-        }
-        
-        .header { 
-            display: table-row;
-            margin-bottom: 20px; 
-            border-bottom: 2px solid #333; 
-            padding-bottom: 20px; 
-        }
-        
-        .header-content {
-            display: table-cell;
-            vertical-align: top;
-            padding-bottom: 20px;
-            border-bottom: 2px solid #333;
-        }
-        
-        .goal { font-size: 2.5em; font-weight: bold; color: #fff; margin: 0; text-transform: uppercase; letter-spacing: 2px; }
-        .reason { font-size: 1.4em; color: #888; margin-top: 10px; font-style: italic; }
-
-        .cal-container { margin-top: 20px; text-align: center; }
-        .cal-text { font-size: 1.5em; font-family: monospace; color: #0ff; display: inline-block; margin-right: 15px; }
-        .cal-bar-bg { 
-            width: 300px; 
-            height: 10px; 
-            background: #333; 
-            border-radius: 5px; 
-            overflow: hidden; 
-            display: inline-block;
-            vertical-align: middle;
-            position: relative;
-        }
-        .cal-bar-fill { 
-            height: 100%; 
-            background: #0ff; 
-            transition: width 0.5s;
-            position: absolute;
-            left: 0;
-            top: 0;
-        }
-        .cal-bar-fill.warning { background: #f00; }
+function listenForUpdates() {
+    // Old browsers without EventSource fall back to long-poll. So do
+    // low-power screens: a stream's keepalives would wake the radio
+    if (lowPower || !window.EventSource) {
+        waitForUpdate();
+        return;
+    }
+    var source = new EventSource(baseUrl + '/api/stream?version=' + currentVersion + '&client=' + screenId);
+    source.addEventListener('plan', function(e) {
+        setStatus('connected');
+        renderState(JSON.parse(e.data));
+    }, false);
+    source.onopen = function() { setStatus('connected'); };
+    source.onerror = function() { setStatus('disconnected'); };
+}
 
-        .content { 
-            display: table-row;
-            height: 100%;
-        }
-        
-        .content-cell {
-            display: table-cell;
-            vertical-align: top;
-            padding-top: 20px;
-        }
-        
-        .reminder { 
-            font-size: 4em; 
-            margin-bottom: 25px; 
-            border-bottom: 1px solid #222; 
-            padding-bottom: 20px; 
-            position: relative;
-        }
-        .time { color: #f00; font-weight: bold; display: block; margin-bottom: 10px; }
-        .desc { color: #ddd; }
-        
-        /* The Countdown Badge */
-        .countdown {
-            font-size: 0.4em; /* Relative to the huge 4em parent */
-            color: #ff9900;
-            display: block;
-            margin-top: 10px;
-            font-family: monospace;
-            font-weight: bold;
-        }
-        .blinking { 
-            -webkit-animation: blinker 1s linear infinite;
-            -moz-animation: blinker 1s linear infinite;
-            animation: blinker 1s linear infinite; 
-            color: #f00; 
-        }
-        @-webkit-keyframes blinker { 50% { opacity: 0; } }
-        @-moz-keyframes blinker { 50% { opacity: 0; } }
-        @keyframes blinker { 50% { opacity: 0; } }
+// T-MINUS COUNTDOWN LOGIC (redraws only when the text would change)
+var countdownTimer = null;
 
-        .more { color: #555; font-size: 1.5em; margin-top: 50px; }
-        .empty { color: #444; margin-top: 100px; font-size: 2em; }
-        
-        .status { position: fixed; bottom: 10px; right: 10px; width: 12px; height: 12px; border-radius: 50%; }
-        .status.connected { 
-            background: #004400; 
-            -webkit-box-shadow: 0 0 5px #0f0; 
-            -moz-box-shadow: 0 0 5px #0f0; 
-            box-shadow: 0 0 5px #0f0; 
-            opacity: 0.6; 
-        }
-        .status.disconnected { 
-            background: #f00; 
-            -webkit-box-shadow: 0 0 10px #f00; 
-            -moz-box-shadow: 0 0 10px #f00; 
-            box-shadow: 0 0 10px #f00; 
-            opacity: 1; 
-        }
-        
-        /* Better mobile support */
-        @media (max-width: 768px) {
-            body { padding: 10px; }
-            .goal { font-size: 2em; }
-            .reminder { font-size: 3em; }
-            .cal-bar-bg { width: 200px; }
-        }
-    </style>
+function updateCountdown() {
+    if (countdownTimer) {
+        clearTimeout(countdownTimer);
+        countdownTimer = null;
+    }
+    if (!nextTargetStr || nextTargetStr === 'None') return;
+
+    var target = new Date(nextTargetStr);
+    var now = new Date(new Date().getTime() + clockOffset);
+    var diff = target - now;
+
+    var el = document.getElementById('countdown-display');
+    if (!el) return;
+
+    if (diff <= 0) {
+        el.innerHTML = "NOW";
+        el.className = "countdown blinking";
+        return;
+    }
+
+    var totalMinutes = Math.floor(diff / (1000 * 60));
+    var hours = Math.floor(totalMinutes / 60);
+    var minutes = totalMinutes % 60;
+
+    // Format: "T- 1h 45m" or just "T- 45m" if less than an hour. Low-power
+    // screens show whole hours while the target is far off
+    var timeText;
+    var step = 60 * 1000;
+    if (lowPower && hours >= 2) {
+        timeText = "T- " + hours + "h";
+        step = 60 * 60 * 1000;
+    } else if (hours > 0) {
+        timeText = "T- " + hours + "h " + minutes + "m";
+    } else {
+        timeText = "T- " + minutes + "m";
+    }
+    el.innerHTML = timeText;
+
+    // Blink if less than 5 minutes
+    if (hours === 0 && minutes < 5) {
+        el.className = "countdown blinking";
+    } else {
+        el.className = "countdown";
+    }
+
+    countdownTimer = setTimeout(updateCountdown, (diff % step || step) + 100);
+}
+
+function onWindowLoad() {
+    fetchState();
+    listenForUpdates();
+    updateCountdown(); // Run immediately on load
+}
+
+// Cross-browser event listener
+if (window.addEventListener) {
+    window.addEventListener('load', onWindowLoad, false);
+} else if (window.attachEvent) {
+    window.attachEvent('onload', onWindowLoad);
+} else {
+    window.onload = onWindowLoad;
+}
+"""
+
+SCREEN_CSS = """
+body { 
+    background: #000; 
+    color: #fff; 
+    font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; 
+    text-align: center; 
+    margin: 0; 
+    padding: 20px; 
+}
+
+.container {
+    display: table;
+    width: 100%;
+    height: 95vh;
+    table-layout: fixed;
+}
+
+.header { 
+    display: table-row;
+    margin-bottom: 20px; 
+    border-bottom: 2px solid #333; 
+    padding-bottom: 20px; 
+}
+
+.header-content {
+    display: table-cell;
+    vertical-align: top;
+    padding-bottom: 20px;
+    border-bottom: 2px solid #333;
+}
+
+.goal { font-size: 2.5em; font-weight: bold; color: #fff; margin: 0; text-transform: uppercase; letter-spacing: 2px; }
+.reason { font-size: 1.4em; color: #888; margin-top: 10px; font-style: italic; }
+
+.cal-container { margin-top: 20px; text-align: center; }
+.cal-text { font-size: 1.5em; font-family: monospace; color: #0ff; display: inline-block; margin-right: 15px; }
+.cal-bar-bg { 
+    width: 300px; 
+    height: 10px; 
+    background: #333; 
+    border-radius: 5px; 
+    overflow: hidden; 
+    display: inline-block;
+    vertical-align: middle;
+    position: relative;
+}
+.cal-bar-fill { 
+    height: 100%; 
+    background: #0ff; 
+    transition: width 0.5s;
+    position: absolute;
+    left: 0;
+    top: 0;
+}
+.cal-bar-fill.warning { background: #f00; }
+
+.content { 
+    display: table-row;
+    height: 100%;
+}
+
+.content-cell {
+    display: table-cell;
+    vertical-align: top;
+    padding-top: 20px;
+}
+
+.reminder { 
+    font-size: 4em; 
+    margin-bottom: 25px; 
+    border-bottom: 1px solid #222; 
+    padding-bottom: 20px; 
+    position: relative;
+}
+.time { color: #f00; font-weight: bold; display: block; margin-bottom: 10px; }
+.desc { color: #ddd; }
+
+/* The Countdown Badge */
+.countdown {
+    font-size: 0.4em; /* Relative to the huge 4em parent */
+    color: #ff9900;
+    display: block;
+    margin-top: 10px;
+    font-family: monospace;
+    font-weight: bold;
+}
+.blinking { 
+    -webkit-animation: blinker 1s linear infinite;
+    -moz-animation: blinker 1s linear infinite;
+    animation: blinker 1s linear infinite; 
+    color: #f00; 
+}
+@-webkit-keyframes blinker { 50% { opacity: 0; } }
+@-moz-keyframes blinker { 50% { opacity: 0; } }
+@keyframes blinker { 50% { opacity: 0; } }
+
+.more { color: #555; font-size: 1.5em; margin-top: 50px; }
+.empty { color: #444; margin-top: 100px; font-size: 2em; }
+
+.status { position: fixed; bottom: 10px; right: 10px; width: 12px; height: 12px; border-radius: 50%; }
+.status.connected { 
+    background: #004400; 
+    -webkit-box-shadow: 0 0 5px #0f0; 
+    -moz-box-shadow: 0 0 5px #0f0; 
+    box-shadow: 0 0 5px #0f0; 
+    opacity: 0.6; 
+}
+.status.disconnected { 
+    background: #f00; 
+    -webkit-box-shadow: 0 0 10px #f00; 
+    -moz-box-shadow: 0 0 10px #f00; 
+    box-shadow: 0 0 10px #f00; 
+    opacity: 1; 
+}
+
+/* Better mobile support */
+@media (max-width: 768px) {
+    body { padding: 10px; }
+    .goal { font-size: 2em; }
+    .reminder { font-size: 3em; }
+    .cal-bar-bg { width: 200px; }
+}
+"""
+
+# --- HARDCODED TEMPLATES ---
+
+HTML_INDEX = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Endurance Screen</title>
+    {% if not low_power %}<meta http-equiv="refresh" content="300">{% endif %}
+    <script>
+        var currentVersion = {{ page_version }};
+        var baseUrl = "{{ base_url }}";
+        var nextTargetStr = "{{ next_target }}"; // ISO string from server
+        var nextChange = {{ next_change }}; // when the plan next changes by itself
+        var lowPower = {{ 'true' if low_power else 'false' }};
+    </script>
+    <script src="{{ asset_urls['screen.js'] }}"></script>
+    <link rel="stylesheet" href="{{ asset_urls['screen.css'] }}">
 </head>
 <body>
     <div class="container">
-        {% if goal or reason or calorie_target %}
-        <div class="header">
-            <div class="header-content">
+        <div id="header" class="header"{% if not (goal or reason or calorie_target) %} style="display: none;"{% endif %}>
+            <div id="header-content" class="header-content">
                 {% if goal %}<div class="goal">{{ goal }}</div>{% endif %}
                 {% if reason %}<div class="reason">{{ reason }}</div>{% endif %}
                 
@@ -309,10 +463,9 @@ HTML_INDEX = """
                 {% endif %}
             </div>
         </div>
-        {% endif %}
 
         <div class="content">
-            <div class="content-cell">
+            <div id="content-cell" class="content-cell">
                 {% if display_reminders %}
                     {% for r in display_reminders %}
                         <div class="reminder">
@@ -399,17 +552,32 @@ HTML_EDIT = """
 </html>
 """
 
+# --- METRICS ---
+
+PARSE_SECONDS = metrics.Histogram('endure_parse_seconds', 'Time spent parsing plan text')
+HASH_SECONDS = metrics.Histogram('endure_hash_seconds', 'Time spent hashing plan text')
+RENDER_SECONDS = {page: metrics.Histogram('endure_render_seconds', 'Time spent rendering pages', {'page': page})
+                  for page in ('index', 'index_low_power', 'edit')}
+PARKED_WAITERS = metrics.Gauge('endure_parked_waiters', 'Polls and streams currently waiting for a change')
+NOTIFICATIONS = metrics.Counter('endure_notifications_total', 'Plan change notifications sent to waiters')
+WAKEUPS = metrics.Histogram('endure_wakeups_per_notify', 'Waiters woken by each notification',
+                            buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000))
+POLL_RESULTS = {result: metrics.Counter('endure_polls_total', 'Finished /api/poll requests by outcome',
+                                        {'result': result})
+                for result in ('immediate', 'changed', 'timeout')}
+REQUESTS = metrics.Counter('endure_requests_total', 'HTTP requests handled')
+FILE_READS = metrics.Counter('endure_file_reads_total', 'Plan files read from disk')
+WRITES = metrics.Counter('endure_writes_total', 'Plan writes accepted')
+CONFLICTS = metrics.Counter('endure_conflicts_total', 'Plan writes rejected as conflicts (409)')
+
+# Screens polling or streaming from this process, see /api/screens
+SCREENS = screens.Registry()
+
 # --- HELPER FUNCTIONS ---
 
 def calculate_hash(content):
-    return hashlib.md5(content.encode('utf-8')).hexdigest()
-
-def get_file_content_safe():
-    if not os.path.exists(REMINDERS_FILE):
-        return DEFAULT_CONTENT
-    with open(REMINDERS_FILE, 'r') as f:
-        content = f.read()
-        return content if content.strip() else DEFAULT_CONTENT
+    with HASH_SECONDS.time(), profiling.phase('hash'):
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
 
 def extract_calories(text):
     match = re.search(r'\b(\d+)\s*(?:k?cal)\b', text, re.IGNORECASE)
@@ -417,138 +585,691 @@ def extract_calories(text):
         return int(match.group(1))
     return 0
 
-def parse_file():
-    if not os.path.exists(REMINDERS_FILE):
-        return None, None, None, 0, []
-    
-    with open(REMINDERS_FILE, 'r') as f:
-        lines = f.readlines()
-    
-    reminders = []
-    goal = None
-    reason = None
-    calorie_target = None
-    calories_eaten = 0
-    now = datetime.now()
-    
-    for line in lines:
-        line = line.strip()
-        if not line: continue
+def parse_line(line):
+    """What one plan line says, independent of every other line.
 
-        lower_line = line.lower()
-        if lower_line.startswith('goal:'):
-            goal = line.split(':', 1)[1].strip()
-            continue
-        if lower_line.startswith('reason:'):
-            reason = line.split(':', 1)[1].strip()
-            continue
-        if lower_line.startswith('calorie target:') or lower_line.startswith('calories:'):
-            try:
-                target_str = line.split(':', 1)[1].strip()
-                target_digits = re.sub(r'[^\d]', '', target_str)
-                if target_digits:
-                    calorie_target = int(target_digits)
-            except ValueError:
-                pass
-            continue
+    One of ('goal', text), ('reason', text), ('calorie_target', int),
+    ('entry', timeline.Entry) or None for comments, blanks and noise.
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    lower_line = line.lower()
+    if lower_line.startswith('goal:'):
+        return 'goal', line.split(':', 1)[1].strip()
+    if lower_line.startswith('reason:'):
+        return 'reason', line.split(':', 1)[1].strip()
+    if lower_line.startswith('calorie target:') or lower_line.startswith('calories:'):
+        target_digits = re.sub(r'[^\d]', '', line.split(':', 1)[1])
+        if target_digits:
+            return 'calorie_target', int(target_digits)
+        return None
+
+    if line.startswith('#') or '|' not in line:
+        return None
+
+    time_str, description = line.split('|', 1)
+    description = description.strip()
+    entry = parse_entry(time_str.strip(), description, extract_calories(description))
+    if entry is None:
+        return None
+    return 'entry', entry
 
-        if line.startswith('#') or '|' not in line:
+def summarize(parsed):
+    """Fold per-line results into (goal, reason, calorie_target, entries); later headers win."""
+    headers = {'goal': None, 'reason': None, 'calorie_target': None}
+    entries = []
+    for result in parsed:
+        if result is None:
             continue
-        
-        time_str, description = line.split('|', 1)
-        time_str = time_str.strip()
-        description = description.strip()
-        
-        item_cals = extract_calories(description)
-        
+        kind, value = result
+        if kind == 'entry':
+            entries.append(value)
+        else:
+            headers[kind] = value
+    return headers['goal'], headers['reason'], headers['calorie_target'], entries
+
+# --- PLAN CACHE ---
+
+class Plan:
+    """A snapshot of the reminders file: raw text, digest and parse.
+
+    `version` is assigned when the plan is published and only moves forward,
+    so "has this screen seen the latest plan?" is an integer compare. It also
+    moves when a reminder comes due; `text_version` only moves with the text.
+
+    Entries are indexed in a Timeline with running calorie totals, so
+    "consumed today" and "next N" are bisects rather than a scan. Given the
+    `previous` plan, only the lines that differ from it are parsed and only
+    their entries are moved in the timeline.
+    """
+
+    def __init__(self, content, stat_key=None, previous=None):
+        self.content = content if content.strip() else DEFAULT_CONTENT
+        self.hash = calculate_hash(self.content)
+        self.version = None
+        self.text_version = None
+        self.stat_key = stat_key
+        self.modified = stat_key[0] / 1e9 if stat_key else time.time()
+        self.lines = self.content.splitlines()
+        with PARSE_SECONDS.time(), profiling.phase('parse'):
+            if previous is None:
+                self.parsed = [parse_line(line) for line in self.lines]
+                self.goal, self.reason, self.calorie_target, entries = summarize(self.parsed)
+                self.timeline = Timeline(entries)
+            else:
+                self._parse_edit(previous)
+
+    def _parse_edit(self, previous):
+        """Parse only the lines between the prefix and suffix shared with `previous`."""
+        lines, old_lines = self.lines, previous.lines
+        limit = min(len(lines), len(old_lines))
+        start = 0
+        while start < limit and lines[start] == old_lines[start]:
+            start += 1
+        end = 0
+        while end < limit - start and lines[-1 - end] == old_lines[-1 - end]:
+            end += 1
+
+        removed = previous.parsed[start:len(old_lines) - end]
+        # Lines moved within the edited block keep their parse too
+        known = dict(zip(old_lines[start:len(old_lines) - end], removed))
+        added = [known[line] if line in known else parse_line(line) for line in lines[start:len(lines) - end]]
+        self.parsed = previous.parsed[:start] + added + previous.parsed[len(old_lines) - end:]
+
+        if any(result[0] != 'entry' for result in removed + added if result is not None):
+            self.goal, self.reason, self.calorie_target, _ = summarize(self.parsed)
+        else:
+            self.goal, self.reason, self.calorie_target = previous.goal, previous.reason, previous.calorie_target
+        self.timeline = previous.timeline.updated(
+            [result[1] for result in removed if result is not None and result[0] == 'entry'],
+            [result[1] for result in added if result is not None and result[0] == 'entry'])
+
+    def window(self, now, count):
+        """Calories eaten today by `now`, the next `count` reminders and how many follow that day."""
+        today = now.toordinal()
+        minute = now.hour * 60 + now.minute
+        upcoming = self.timeline.upcoming(now, count)
+
+        reminders = []
+        for day, m, entry in upcoming:
+            reminders.append({
+                'time': occurrence_time(day, m),
+                'time_str': occurrence_label(entry, day, today),
+                'description': entry.description,
+            })
+        remaining = self.timeline.count(upcoming[-1][0], upcoming[-1][1]) if upcoming else 0
+        return self.timeline.consumed(today, minute), reminders, remaining
+
+    def next_boundary(self, now):
+        """When the display next changes by itself: the next reminder, or midnight."""
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        upcoming = self.timeline.upcoming(now, 1)
+        if upcoming:
+            return min(midnight, occurrence_time(*upcoming[0][:2]))
+        return midnight
+
+# Seeded from the clock so versions keep increasing across restarts
+_versions = itertools.count(int(time.time() * 1000))
+
+class PlanConflict(Exception):
+    """A write was based on a version of the plan that is no longer current.
+
+    For patched saves, `conflicts` holds the clashing (client, server) hunks.
+    """
+
+    def __init__(self, plan, conflicts=None):
+        super().__init__('plan has changed')
+        self.plan = plan
+        self.conflicts = conflicts
+
+class PlanStore:
+    """One named plan: its file, the cached Plan and the screens waiting on it.
+
+    Every store has its own lock and condition, so saving a plan only wakes
+    the screens showing that plan. Writes replace the file atomically and
+    append the new text to a history log next to it (`<file>.history`, one
+    JSON object per line) which serves old versions without touching the
+    plan file.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.history_path = path + '.history'
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.waiting = 0
+        # (version, monotonic time) of the last notification, for screen update latency
+        self.notified = None
+        # Extra callbacks run on every published change (e.g. the asyncio engine's waiters)
+        self.listeners = []
+        # Last rendered body per page as (key, bytes), see cached_page
+        self.pages = {}
+        self._plan = None
+        # (version, hash, modified, offset, length) per logged version, oldest first
+        self._history = None
+        # Pending coalesced notification, see notify_soon
+        self._notify_lock = threading.Lock()
+        self._notify_timer = None
+        self.stats = {'writes': 0, 'notifications': 0, 'notifications_saved': 0}
+
+    @property
+    def base_url(self):
+        return '' if self.name is None else '/p/' + self.name
+
+    def _stat_key(self):
         try:
-            reminder_time = datetime.strptime(time_str, '%H:%M').replace(
-                year=now.year, month=now.month, day=now.day
-            )
-            
-            if reminder_time <= now:
-                calories_eaten += item_cals
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _load(self):
+        stat_key = self._stat_key()
+        if stat_key is None:
+            return Plan('', None)
+        FILE_READS.inc()
+        with profiling.phase('io'), open(self.path, 'r') as f:
+            content = f.read()
+        return Plan(content, stat_key, self._plan)
+
+    def _write_file(self, content):
+        """Replace the plan file so readers see either the old or the new text."""
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        try:
+            mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path) + '.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _load_history(self):
+        """Index the history log. Call with self.lock held."""
+        if self._history is not None:
+            return self._history
+        self._history = []
+        try:
+            with open(self.history_path, 'r+b') as f:
+                offset = 0
+                for line in f:
+                    try:
+                        entry = json.loads(line) if line.endswith(b'\n') else None
+                    except ValueError:
+                        entry = None
+                    if entry is None:
+                        # Torn final line from a crash: cut it off, or the
+                        # next append would be glued to it and lost as well
+                        print("Dropping a torn entry at the end of {}".format(self.history_path))
+                        f.truncate(offset)
+                        break
+                    self._history.append((entry['version'], entry['hash'], entry['modified'], offset, len(line)))
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        return self._history
+
+    def _append_history(self, plan):
+        line = (json.dumps({
+            'version': plan.text_version,
+            'hash': plan.hash,
+            'modified': plan.modified,
+            'content': plan.content,
+        }) + '\n').encode('utf-8')
+        with open(self.history_path, 'ab') as f:
+            offset = f.tell()
+            f.write(line)
+        self._history.append((plan.text_version, plan.hash, plan.modified, offset, len(line)))
+
+    def _publish(self, plan):
+        """Make `plan` current. Call with self.lock held. Returns True if the text changed."""
+        history = self._load_history()
+        if self._plan is not None and self._plan.hash == plan.hash:
+            plan.version, plan.text_version = self._plan.version, self._plan.text_version
+            self._plan = plan
+            return False
+
+        if self._plan is None and history and history[-1][1] == plan.hash:
+            # Unchanged since the last run: keep its text version, so saves based on
+            # it still apply, but never reuse a version older than this run's
+            plan.text_version = history[-1][0]
+            plan.version = next(_versions)
+        else:
+            plan.version = plan.text_version = next(_versions)
+            if plan.stat_key is not None:
+                self._append_history(plan)
+        if plan.stat_key is not None:
+            ADHERENCE.record(self.name, self._plan, plan)
+        self._plan = plan
+        return True
+
+    def get(self):
+        """Return the cached plan, loading it from disk on first use."""
+        plan = self._plan
+        if plan is None:
+            with self.lock:
+                if self._plan is None:
+                    self._publish(self._load())
+                plan = self._plan
+            wake_scheduler()
+        return plan
+
+    def write(self, content, base_version=None, base_hash=None):
+        """Write new plan text, refresh the cache and wake waiting screens.
+
+        If the writer says which version (or digest) it edited, the write is a
+        compare-and-swap: PlanConflict is raised if the text has moved on since.
+        """
+        with self.lock:
+            current = self._current()
+            if (base_version is not None and base_version < current.text_version
+                    or base_hash and base_hash != current.hash):
+                CONFLICTS.inc()
+                raise PlanConflict(current)
+            changed = self._commit(content, current)
+
+        if changed:
+            self.notify_soon()
+
+    def patch(self, patch, base_version):
+        """Apply a delta.make_patch patch made against `base_version`.
+
+        If the text has moved on since, the patch is three-way merged with the
+        changes made in between. PlanConflict is raised only when both touched
+        the same lines (or `base_version` is no longer in the history), and
+        delta.PatchError for a patch that doesn't fit its base. Returns True
+        if a merge was needed.
+        """
+        with self.lock:
+            current = self._current()
+            if base_version >= current.text_version:
+                content = delta.apply_patch(current.content, patch)
+                merged = False
             else:
-                reminders.append({
-                    'time': reminder_time,
-                    'time_str': time_str,
-                    'description': description,
-                })
-        except ValueError:
-            continue
-    
-    return goal, reason, calorie_target, calories_eaten, sorted(reminders, key=lambda x: x['time'])
+                base = self._content_as_of(base_version)
+                if base is None:
+                    CONFLICTS.inc()
+                    raise PlanConflict(current)
+                try:
+                    content = delta.merge(base, current.content, patch)
+                except delta.MergeConflict as e:
+                    CONFLICTS.inc()
+                    raise PlanConflict(current, e.hunks)
+                merged = True
+            changed = self._commit(content, current)
 
-# --- API ROUTES ---
+        if changed:
+            self.notify_soon()
+        return merged
 
-@app.route('/api/poll')
-def api_poll():
-    client_hash = request.args.get('hash')
-    timeout = 30
-    
-    current_content = get_file_content_safe()
-    current_hash = calculate_hash(current_content)
-    
-    if current_hash != client_hash:
-        return jsonify({'changed': True, 'hash': current_hash})
+    def _current(self):
+        """The current plan, loading it first if need be. Call with self.lock held."""
+        if self._plan is None:
+            self._publish(self._load())
+        return self._plan
 
-    with update_condition:
-        update_condition.wait(timeout=timeout)
-    
-    current_content = get_file_content_safe()
-    current_hash = calculate_hash(current_content)
-    
-    if current_hash != client_hash:
-        return jsonify({'changed': True, 'hash': current_hash})
-        
-    return jsonify({'changed': False})
+    def _commit(self, content, current):
+        """Write `content` over `current` and publish it. Call with self.lock held."""
+        WRITES.inc()
+        with profiling.phase('io'):
+            self._write_file(content)
+        return self._publish(Plan(content, self._stat_key(), current))
 
-@app.route('/api/reminders', methods=['GET', 'POST'])
-def api_reminders():
-    content = get_file_content_safe()
+    def advance(self):
+        """Republish the current plan under a new version because a reminder came due."""
+        with self.lock:
+            if self._plan is None:
+                return
+            plan = copy.copy(self._plan)
+            plan.version = next(_versions)
+            self._plan = plan
 
-    if request.method == 'GET':
-        return jsonify({'content': content, 'hash': calculate_hash(content)})
+        self.notify()
 
-    if request.method == 'POST':
-        data = request.json
-        if not data: return jsonify({'error': 'No JSON data'}), 400
+    def reload_if_changed(self):
+        """Pick up edits made to the file behind our back. Returns True on change."""
+        with self.lock:
+            if self._plan is not None and self._stat_key() == self._plan.stat_key:
+                return False
+            changed = self._publish(self._load())
 
-        new_content = data.get('content', '')
-        client_hash = data.get('hash')
-        current_hash = calculate_hash(content)
+        if changed:
+            self.notify_soon()
+        return changed
 
-        if client_hash and client_hash != current_hash:
-            return jsonify({'current_content': content}), 409
-            
-        with open(REMINDERS_FILE, 'w') as f:
-            f.write(new_content)
-        
-        with update_condition:
-            update_condition.notify_all()
-            
-        return jsonify({'status': 'success'})
+    def history(self, limit=None):
+        """Logged versions, newest first, as dicts of version, hash and modified."""
+        with self.lock:
+            entries = list(self._load_history())
+        if limit is not None:
+            entries = entries[-limit:] if limit > 0 else []
+        return [{'version': version, 'hash': digest, 'modified': modified}
+                for version, digest, modified, _, _ in reversed(entries)]
 
-# --- BROWSER ROUTES ---
+    def adherence(self, first, last, with_curve=False):
+        """Per-day consumed against target from day `first` to `last` (ordinals), see AdherenceLog.days."""
+        return ADHERENCE.days(self.name, self.get(), first, last, datetime.now(), with_curve)
 
-@app.route('/')
-def index():
-    goal, reason, calorie_target, calories_eaten, reminders = parse_file()
-    display_reminders = reminders[:3] if reminders else []
-    remaining_count = max(0, len(reminders) - 3)
-    
-    current_content = get_file_content_safe()
-    page_hash = calculate_hash(current_content)
+    def get_stats(self):
+        with self._notify_lock:
+            return dict(self.stats)
+
+    def content_at(self, version):
+        """The text of a logged version, or None if there is no such version."""
+        with self.lock:
+            entries = list(self._load_history())
+        index = bisect.bisect_left(entries, (version,))
+        if index == len(entries) or entries[index][0] != version:
+            return None
+        return self._read_history(entries[index])
+
+    def _content_as_of(self, version):
+        """The text that was current at `version` (any version, not just text ones). Call with self.lock held."""
+        entries = self._load_history()
+        index = bisect.bisect_right(entries, (version + 1,)) - 1
+        if index < 0:
+            return None
+        return self._read_history(entries[index])
+
+    def _read_history(self, entry):
+        _, _, _, offset, length = entry
+        with open(self.history_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))['content']
+
+    def notify_soon(self):
+        """Notify for a new text, batching bursts of writes into one wakeup.
+
+        With a COALESCE_WINDOW the first write of a burst schedules a single
+        notification that far ahead and later writes ride along with it. The
+        plan itself is always current, so the last write wins and reaches
+        screens at most one window after the first.
+        """
+        with self._notify_lock:
+            self.stats['writes'] += 1
+            if COALESCE_WINDOW > 0:
+                if self._notify_timer is not None:
+                    self.stats['notifications_saved'] += 1
+                else:
+                    self._notify_timer = threading.Timer(COALESCE_WINDOW, self._flush_notify)
+                    self._notify_timer.daemon = True
+                    self._notify_timer.start()
+                return
+        self.notify()
+
+    def _flush_notify(self):
+        with self._notify_lock:
+            self._notify_timer = None
+        self.notify()
+
+    def notify(self):
+        """Wake everything waiting for this plan to change."""
+        with self._notify_lock:
+            self.stats['notifications'] += 1
+        NOTIFICATIONS.inc()
+        self.notified = (self._plan.version, time.monotonic())
+        with self.condition:
+            WAKEUPS.observe(self.waiting)
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+        wake_scheduler()
+
+    def wait(self, plan, timeout):
+        """Block until the plan moves on from `plan` or `timeout` passes."""
+        with self.condition:
+            if self._plan is plan:
+                self.waiting += 1
+                PARKED_WAITERS.inc()
+                try:
+                    with profiling.phase('wait'):
+                        self.condition.wait(timeout=timeout)
+                finally:
+                    self.waiting -= 1
+                    PARKED_WAITERS.dec()
+        return self.get()
+
+PLAN_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+PLANS_DIR = 'plans'
+# Seconds to batch rapid writes into one notification; 0 notifies every write
+COALESCE_WINDOW = 0.0
+# Per-day history of every plan, see /api/timeline
+ADHERENCE = adherence.AdherenceLog('adherence.sqlite3')
+
+stores = {}
+stores_lock = threading.Lock()
+
+# Swapped out by worker processes, whose plans live in the supervisor, and by replicas
+store_factory = PlanStore
+
+def plan_exists(name, path):
+    """Whether named plan `name` has been saved. Workers ask the hub and replicas the primary instead."""
+    return os.path.exists(path)
+
+def get_store(name=None, create=False):
+    """The store for plan `name`; None is the default plan.
+
+    Returns None for bad names, and for named plans that don't exist yet
+    unless `create` (a save), so reading made-up names costs nothing.
+    """
+    store = stores.get(name)
+    if store is None:
+        if name is not None and not PLAN_NAME_RE.match(name):
+            return None
+        path = REMINDERS_FILE if name is None else os.path.join(PLANS_DIR, name + '.txt')
+        if name is not None and not create and not plan_exists(name, path):
+            return None
+        with stores_lock:
+            store = stores.get(name)
+            if store is None:
+                store = stores[name] = store_factory(name, path)
+    return store
+
+def store_or_404(name, create=False):
+    store = get_store(name, create)
+    if store is None:
+        if '/api/' in request.path:
+            # Clients tell a plan nobody has saved yet from a wrong URL by this
+            response = jsonify({'error': 'No such plan'})
+            response.status_code = 404
+            abort(response)
+        abort(404)
+    return store
+
+def split_plan_path(path):
+    """Split '/p/<name>/rest' into (name, '/rest'). Other paths are the default plan's."""
+    if path.startswith('/p/'):
+        name, _, rest = path[3:].partition('/')
+        return name, '/' + rest
+    return None, path
+
+def is_current(plan, version=None, digest=None):
+    """Whether a client holding `version` (or a digest, from older pages) is up to date."""
+    if version is not None:
+        return version == plan.version
+    return digest == plan.hash
+
+def parse_version(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# Bumped on every publish so the scheduler never sleeps through a new plan
+schedule_condition = threading.Condition()
+_schedule_generation = 0
+
+def wake_scheduler():
+    global _schedule_generation
+    with schedule_condition:
+        _schedule_generation += 1
+        schedule_condition.notify_all()
+
+def schedule_boundaries():
+    """Wake screens in a daemon thread exactly when each reminder comes due.
+
+    One thread covers every plan: it sleeps until the earliest boundary and
+    recomputes whenever any plan is published.
+    """
+    def loop():
+        while True:
+            with schedule_condition:
+                generation = _schedule_generation
+            now = datetime.now()
+            due = []
+            for store in list(stores.values()):
+                try:
+                    due.append((store.get().next_boundary(now), store))
+                except (OSError, ValueError, RuntimeError) as e:
+                    # One unreadable plan mustn't stop the others' reminders
+                    print("Error scheduling {}: {}".format(store.path, e))
+            wake_at = min((when for when, _ in due), default=None)
+
+            with schedule_condition:
+                if generation == _schedule_generation:
+                    delay = (wake_at - datetime.now()).total_seconds() if wake_at else None
+                    schedule_condition.wait(timeout=None if delay is None else max(0, delay))
+
+            now = datetime.now()
+            for when, store in due:
+                if when <= now:
+                    try:
+                        store.advance()
+                    except (OSError, ValueError, RuntimeError) as e:
+                        print("Error advancing {}: {}".format(store.path, e))
+
+    thread = threading.Thread(target=loop, name='plan-scheduler', daemon=True)
+    thread.start()
+    return thread
+
+def watch_plan_file(interval=1.0):
+    """Poll plan files' mtimes in a daemon thread so external edits reach screens."""
+    def loop():
+        # Stat of each file that failed to load, so a bad edit is reported once rather than every pass
+        failed = {}
+        while True:
+            time.sleep(interval)
+            for store in list(stores.values()):
+                try:
+                    store.reload_if_changed()
+                    failed.pop(store.name, None)
+                except (OSError, ValueError) as e:
+                    key = store._stat_key()
+                    if failed.get(store.name, False) != key:
+                        failed[store.name] = key
+                        print("Error reloading {}: {}".format(store.path, e))
+
+    thread = threading.Thread(target=loop, name='plan-watcher', daemon=True)
+    thread.start()
+    return thread
+
+def plan_state(plan, now=None):
+    """The JSON-friendly state a screen needs to draw itself."""
+    now = now or datetime.now()
+    calories_eaten, reminders, remaining_count = plan.window(now, DISPLAY_COUNT)
+    return {
+        'version': plan.version,
+        'hash': plan.hash,
+        'goal': plan.goal,
+        'reason': plan.reason,
+        'calorie_target': plan.calorie_target,
+        'calories_eaten': calories_eaten,
+        'reminders': [{'time_str': r['time_str'], 'description': r['description']}
+                      for r in reminders],
+        'remaining_count': remaining_count,
+        'next_target': reminders[0]['time'].isoformat() if reminders else None,
+        'next_change': plan.next_boundary(now).timestamp(),
+    }
+
+def poll_timeout(value):
+    """How long a poll may park: ?timeout= clamped to MAX_POLL_TIMEOUT."""
+    timeout = parse_version(value)
+    if timeout is None:
+        return POLL_TIMEOUT
+    return min(max(timeout, 1), MAX_POLL_TIMEOUT)
+
+def poll_reply(plan, changed):
+    """Every poll answer says when the plan next changes by itself so idle screens can sleep until then."""
+    reply = {'changed': changed, 'next_change': plan.next_boundary(datetime.now()).timestamp(),
+             'server_time': time.time()}
+    if changed:
+        reply['version'] = plan.version
+        reply['hash'] = plan.hash
+    return reply
+
+def timed_state(plan):
+    state = plan_state(plan)
+    state['server_time'] = time.time()
+    return state
+
+def sse_event(state):
+    return 'id: {}\nevent: plan\ndata: {}\n\n'.format(state['version'], json.dumps(state))
+
+# --- PAGE CACHE ---
+
+# Compiled once; render_template_string would look up and compile per request
+INDEX_TEMPLATE = app.jinja_env.from_string(HTML_INDEX)
+EDIT_TEMPLATE = app.jinja_env.from_string(HTML_EDIT)
+
+class Asset:
+    """A static file kept in memory, with its gzip form compressed once at startup."""
+
+    def __init__(self, name, text, mimetype):
+        self.body = text.encode('utf-8')
+        self.gzipped = gzip.compress(self.body, 9, mtime=0)
+        self.digest = hashlib.sha256(self.body).hexdigest()[:12]
+        self.mimetype = mimetype
+        stem, ext = os.path.splitext(name)
+        self.name = name
+        self.filename = '{}.{}{}'.format(stem, self.digest, ext)
+
+ASSETS = {asset.filename: asset for asset in (
+    Asset('screen.js', SCREEN_JS, 'application/javascript'),
+    Asset('screen.css', SCREEN_CSS, 'text/css'),
+)}
+ASSET_URLS = {asset.name: '/assets/' + asset.filename for asset in ASSETS.values()}
+# Part of the index ETag so a server upgrade isn't answered with a 304 for a
+# page that points at assets this process no longer serves
+ASSET_TAG = hashlib.sha256(''.join(sorted(ASSETS)).encode('utf-8')).hexdigest()[:8]
+
+def cached_page(store, name, key, render):
+    """Rendered bytes for page `name`, rebuilt only when `key` changes."""
+    entry = store.pages.get(name)
+    if entry is None or entry[0] != key:
+        with RENDER_SECONDS[name].time(), profiling.phase('render'):
+            entry = (key, render().encode('utf-8'))
+        store.pages[name] = entry
+    return entry[1]
+
+def conditional_page(body, etag, last_modified):
+    response = make_response(body)
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def render_index(store, plan, now, low_power=False):
+    calories_eaten, display_reminders, remaining_count = plan.window(now, DISPLAY_COUNT)
     
     next_target = None
     time_diff_minutes = None
 
-    if reminders:
-        next_event = reminders[0]['time']
+    if display_reminders:
+        next_event = display_reminders[0]['time']
         next_target = next_event.isoformat()
         
         # Calculate time diff for server-side render
-        now = datetime.now()
         diff = next_event - now
         total_seconds = diff.total_seconds()
         
@@ -557,43 +1278,368 @@ def index():
         else:
             time_diff_minutes = 0
 
-    return render_template_string(HTML_INDEX, 
-                                goal=goal,
-                                reason=reason,
-                                calorie_target=calorie_target,
-                                calories_eaten=calories_eaten,
-                                display_reminders=display_reminders,
-                                remaining_count=remaining_count,
-                                page_hash=page_hash,
-                                next_target=next_target,
-                                time_diff_minutes=time_diff_minutes)
-
-@app.route('/edit', methods=['GET', 'POST'])
-def edit():
-    if request.method == 'POST' and 'save' in request.form:
+    return INDEX_TEMPLATE.render(goal=plan.goal,
+                                 reason=plan.reason,
+                                 calorie_target=plan.calorie_target,
+                                 calories_eaten=calories_eaten,
+                                 display_reminders=display_reminders,
+                                 remaining_count=remaining_count,
+                                 page_version=plan.version,
+                                 asset_urls=ASSET_URLS,
+                                 base_url=store.base_url,
+                                 next_target=next_target,
+                                 next_change=plan.next_boundary(now).timestamp(),
+                                 low_power=low_power,
+                                 time_diff_minutes=time_diff_minutes)
+
+# --- API ROUTES ---
+
+@app.before_request
+def count_request():
+    REQUESTS.inc()
+    if profiling.ENABLED:
+        profiling.begin(request.method + ' ' + request.path)
+
+@app.after_request
+def add_server_timing(response):
+    timing = profiling.end() if profiling.ENABLED else None
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/poll', defaults={'name': None})
+@app.route('/p/<name>/api/poll')
+def api_poll(name):
+    store = store_or_404(name)
+    client_version = request.args.get('version', type=int)
+    client_hash = request.args.get('hash')
+    timeout = poll_timeout(request.args.get('timeout'))
+    
+    plan = store.get()
+    screen = SCREENS.connect(request.args.get('client'), name, request.remote_addr, request.user_agent.string,
+                             client_version, store.notified)
+    parked = None
+    try:
+        if not is_current(plan, client_version, client_hash):
+            POLL_RESULTS['immediate'].inc()
+            return jsonify(poll_reply(plan, True))
+
+        started = time.monotonic()
+        plan = store.wait(plan, timeout)
+        parked = time.monotonic() - started
+
+        if not is_current(plan, client_version, client_hash):
+            POLL_RESULTS['changed'].inc()
+            return jsonify(poll_reply(plan, True))
+
+        POLL_RESULTS['timeout'].inc()
+        return jsonify(poll_reply(plan, False))
+    finally:
+        SCREENS.disconnect(screen, parked)
+
+@app.route('/api/stream', defaults={'name': None})
+@app.route('/p/<name>/api/stream')
+def api_stream(name):
+    store = store_or_404(name)
+    # Load it now, while a failure (a replica's primary away) can still be an error response
+    store.get()
+    # EventSource resends the last id on reconnect so screens that are already
+    # up to date do not get a duplicate event
+    resumed = 'Last-Event-ID' in request.headers
+    last_version = parse_version(request.headers.get('Last-Event-ID') or request.args.get('version'))
+    client = (request.args.get('client'), name, request.remote_addr, request.user_agent.string)
+
+    def events(sent):
+        screen = SCREENS.connect(*client, sent, store.notified, resumed)
+        try:
+            yield 'retry: 5000\n\n'
+            plan = store.get()
+            while True:
+                if plan.version != sent:
+                    sent = plan.version
+                    yield sse_event(timed_state(plan))
+                    SCREENS.seen(screen, sent, store.notified)
+                else:
+                    yield ': keepalive\n\n'
+
+                plan = store.wait(plan, STREAM_KEEPALIVE)
+        finally:
+            SCREENS.disconnect(screen)
+
+    return Response(events(last_version), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/state', defaults={'name': None})
+@app.route('/p/<name>/api/state')
+def api_state(name):
+    """What the screen shows, as JSON. Revalidates with a 304 until the version moves.
+
+    No server_time in the body, which the browser may replay long after; screens
+    take the clock from the Date header and from poll replies instead.
+    """
+    store = store_or_404(name)
+    plan = store.get()
+    response = jsonify(plan_state(plan))
+    response.set_etag(str(plan.version))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/reminders', methods=['GET', 'POST'], defaults={'name': None})
+@app.route('/p/<name>/api/reminders', methods=['GET', 'POST'])
+def api_reminders(name):
+    store = store_or_404(name, create=request.method == 'POST')
+    plan = store.get()
+    content = plan.content
+
+    if request.method == 'GET':
+        # `features` tells clients this server takes patches; replicas use the text version and mtime
+        return jsonify({'content': content, 'hash': plan.hash, 'version': plan.version,
+                        'text_version': plan.text_version, 'modified': plan.modified, 'features': ['patch']})
+
+    if request.method == 'POST':
+        data = request.json
+        if not data: return jsonify({'error': 'No JSON data'}), 400
+
+        client_hash = data.get('hash')
+        client_version = parse_version(data.get('version'))
+        merged = False
+
+        try:
+            if 'patch' in data:
+                # A line patch against `version`, merged if the plan moved on
+                if client_version is None:
+                    return jsonify({'error': 'A patch needs the version it was made against'}), 400
+                merged = store.patch(data['patch'], client_version)
+            else:
+                store.write(data.get('content', ''), base_version=client_version, base_hash=client_hash)
+        except delta.PatchError as e:
+            return jsonify({'error': str(e)}), 400
+        except PlanConflict as e:
+            return jsonify({'current_content': e.plan.content, 'version': e.plan.version,
+                            'conflicts': e.conflicts}), 409
+
+        plan = store.get()
+        return jsonify({'status': 'success', 'version': plan.version, 'hash': plan.hash, 'merged': merged})
+
+def import_patch(plan, lines, replace):
+    """A delta patch adding imported `lines` to the end of `plan`; with `replace` it also drops the existing entries."""
+    patch = []
+    if replace:
+        for number, result in enumerate(plan.parsed):
+            if result is not None and result[0] == 'entry':
+                if patch and patch[-1][1] == number:
+                    patch[-1][1] += 1
+                else:
+                    patch.append([number, number + 1, []])
+    end = len(plan.lines)
+    if end and not plan.content.endswith('\n') and not (patch and patch[-1][1] == end):
+        # Finish the last line so the first imported one doesn't run into it
+        patch.append([end - 1, end, [plan.content.splitlines(keepends=True)[-1] + '\n']])
+    added = [line + '\n' for line in lines]
+    if patch and patch[-1][1] == end:
+        patch[-1][2].extend(added)
+    else:
+        patch.append([end, end, added])
+    return patch
+
+@app.route('/api/import', methods=['POST'], defaults={'name': None})
+@app.route('/p/<name>/api/import', methods=['POST'])
+def api_import(name):
+    """Add the entries of an uploaded CSV or iCalendar file to the plan, as one new version."""
+    store = store_or_404(name, create=True)
+    mode = request.args.get('mode', 'replace')
+    if mode not in ('replace', 'append'):
+        return jsonify({'error': 'mode must be replace or append'}), 400
+    try:
+        kind = importer.upload_format(request.args.get('format'), request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Built against the plan as it was when the upload started; edits made
+    # meanwhile are merged like any other patch
+    base = store.get()
+    skip_invalid = request.args.get('skip_invalid') == '1'
+    lines, invalid, errors = importer.convert(importer.read_rows(request.stream, kind), skip_invalid)
+    if invalid and not skip_invalid:
+        return jsonify({'error': 'Some rows could not be imported', 'errors': errors}), 400
+    if not lines:
+        return jsonify({'error': 'Nothing to import', 'errors': errors}), 400
+
+    try:
+        merged = store.patch(import_patch(base, lines, mode == 'replace'), base.text_version)
+    except PlanConflict as e:
+        return jsonify({'error': 'The plan was changed in the lines this import replaces',
+                        'version': e.plan.version, 'conflicts': e.conflicts}), 409
+
+    plan = store.get()
+    return jsonify({'status': 'success', 'version': plan.version, 'hash': plan.hash, 'merged': merged,
+                    'imported': len(lines), 'skipped': invalid, 'errors': errors})
+
+@app.route('/api/history', defaults={'name': None})
+@app.route('/p/<name>/api/history')
+def api_history(name):
+    store = store_or_404(name)
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'versions': store.history(limit)})
+
+@app.route('/api/stats', defaults={'name': None})
+@app.route('/p/<name>/api/stats')
+def api_stats(name):
+    store = store_or_404(name)
+    # Replicas' stats come from the hub or primary, along with its window
+    return jsonify(dict({'coalesce_window': COALESCE_WINDOW}, **store.get_stats()))
+
+@app.route('/api/timeline', defaults={'name': None})
+@app.route('/p/<name>/api/timeline')
+def api_timeline(name):
+    store = store_or_404(name)
+    try:
+        last = adherence.parse_day(request.args.get('to'), datetime.now().date())
+        first = adherence.parse_day(request.args.get('from'), last - timedelta(days=29))
+    except ValueError:
+        return jsonify({'error': 'Dates are YYYY-MM-DD'}), 400
+    if first > last or (last - first).days >= adherence.MAX_DAYS:
+        return jsonify({'error': 'from must be before to, at most {} days apart'.format(adherence.MAX_DAYS)}), 400
+    days = store.adherence(first.toordinal(), last.toordinal(), request.args.get('curve') == '1')
+    return jsonify({'from': first.isoformat(), 'to': last.isoformat(), 'days': days})
+
+@app.route('/api/screens')
+def api_screens():
+    response = jsonify(SCREENS.report())
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/version/<int:version>', defaults={'name': None})
+@app.route('/p/<name>/api/version/<int:version>')
+def api_version(version, name):
+    store = store_or_404(name)
+    content = store.content_at(version)
+    if content is None:
+        return jsonify({'error': 'No such version'}), 404
+    return jsonify({'version': version, 'content': content, 'hash': calculate_hash(content)})
+
+# --- BROWSER ROUTES ---
+
+@app.route('/', defaults={'name': None})
+@app.route('/p/<name>/')
+def index(name):
+    store = store_or_404(name)
+    plan = store.get()
+    # The page only changes with the plan or the minute, so render each
+    # (plan, minute) pair once and let reloads revalidate with a 304
+    minute = int(time.time() // 60)
+    etag = '{}-{}-{}'.format(plan.version, minute, ASSET_TAG)
+    last_modified = max(plan.modified, minute * 60)
+    # ?low_power=1 drops the meta refresh and the stream for one long poll per change
+    low_power = request.args.get('low_power', '') not in ('', '0')
+    body = cached_page(store, 'index_low_power' if low_power else 'index', etag,
+                       lambda: render_index(store, plan, datetime.fromtimestamp(minute * 60), low_power))
+    return conditional_page(body, etag, last_modified)
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    asset = ASSETS.get(filename)
+    if asset is None:
+        abort(404)
+    # Names change with the content, so a cached copy never goes stale
+    use_gzip = request.accept_encodings['gzip'] > 0
+    response = make_response(asset.gzipped if use_gzip else asset.body)
+    response.mimetype = asset.mimetype
+    if use_gzip:
+        response.content_encoding = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(asset.digest + ('-gzip' if use_gzip else ''))
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@app.route('/edit', methods=['GET', 'POST'], defaults={'name': None})
+@app.route('/p/<name>/edit', methods=['GET', 'POST'])
+def edit(name):
+    saving = request.method == 'POST' and 'save' in request.form
+    store = get_store(name, create=saving)
+    if store is None:
+        if not PLAN_NAME_RE.match(name):
+            abort(404)
+        # A new plan: start from the instructions, and the first save creates it
+        return EDIT_TEMPLATE.render(content=DEFAULT_CONTENT)
+    if saving:
         content = request.form.get('content', '')
-        with open(REMINDERS_FILE, 'w') as f:
-            f.write(content)
-        
-        with update_condition:
-            update_condition.notify_all()
+        store.write(content)
             
-        return redirect(url_for('edit'))
+        return redirect(url_for('edit', name=name))
     
-    content = get_file_content_safe()
-    return render_template_string(HTML_EDIT, content=content)
+    plan = store.get()
+    body = cached_page(store, 'edit', plan.hash, lambda: EDIT_TEMPLATE.render(content=plan.content))
+    return conditional_page(body, plan.hash, plan.modified)
 
 # --- MAIN ---
 
 def main():
+    global PLANS_DIR, COALESCE_WINDOW
     parser = argparse.ArgumentParser(description="Endure Server")
     parser.add_argument('--host', default='0.0.0.0', help='Host IP')
     parser.add_argument('--port', type=int, default=5000, help='Port')
     parser.add_argument('--debug', action='store_true', help='Debug mode')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Serve with the asyncio engine (cheap idle long-polls)')
+    parser.add_argument('--plans-dir', default=PLANS_DIR,
+                        help='Directory holding named plans served under /p/<name>/')
+    parser.add_argument('--coalesce', type=float, default=COALESCE_WINDOW, metavar='SECONDS',
+                        help='Batch bursts of saves into one screen update per window')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Serve from N worker processes sharing the port')
+    parser.add_argument('--profile', action='store_true',
+                        help='Add Server-Timing headers breaking down where each request spent its time')
+    parser.add_argument('--profile-dir', metavar='DIR',
+                        help='Also cProfile requests and keep dumps of the slowest here (implies --profile)')
+    parser.add_argument('--profile-keep', type=int, default=profiling.KEEP, metavar='N',
+                        help='How many of the slowest request profiles to keep')
+    parser.add_argument('--profile-sample', type=float, default=profiling.SAMPLE, metavar='FRACTION',
+                        help='Fraction of requests to run under cProfile')
+    parser.add_argument('--adherence-db', default=ADHERENCE.path, metavar='PATH',
+                        help='SQLite file keeping each day of every plan for /api/timeline')
+    parser.add_argument('--replica-of', metavar='URL',
+                        help='Mirror the plans of the endure server at URL and forward saves to it')
+    # Internal: how the supervisor starts each worker
+    parser.add_argument('--hub', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-fd', type=int, help=argparse.SUPPRESS)
     args = parser.parse_args()
 
+    PLANS_DIR = args.plans_dir
+    COALESCE_WINDOW = args.coalesce
+    ADHERENCE.path = args.adherence_db
+    profiling.configure(args.profile, args.profile_dir, args.profile_keep, args.profile_sample)
+    if args.replica_of:
+        from . import mirror
+        mirror.configure(args.replica_of)
+
+    if args.hub:
+        from . import workers
+        workers.run_worker(args)
+        return
+
+    watch_plan_file()
+    schedule_boundaries()
+
     print("Starting Endurance Server on http://{}:{}".format(args.host, args.port))
+    if args.workers > 0:
+        from . import workers
+        workers.supervise(args)
+        return
+    if args.use_async:
+        from . import aserver
+        aserver.serve(args.host, args.port)
+        return
     app.run(debug=args.debug, host=args.host, port=args.port, threaded=True)
 
 if __name__ == '__main__':
+    # Run as a script this file is __main__, a copy of the module the engines
+    # and mirror import; start the server from that one so they share its state
+    from endurance_screen.main import main
     main()
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Tiny Prometheus-style metrics for endure-server, served on /metrics.
+
+Each update takes one uncontended lock and a couple of integer adds, so it
+is cheap enough to leave on in the poll path. Metrics are per process; in
+--workers mode each worker reports its own.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+registry = []
+
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+def format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in items) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=None):
+        super().__init__(name, help, labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name + format_labels(self.labels), self.value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=None, buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield self.name + '_bucket' + format_labels(self.labels, {'le': le}), cumulative
+        yield self.name + '_sum' + format_labels(self.labels), total
+        yield self.name + '_count' + format_labels(self.labels), count
+
+
+def render():
+    """The text exposition format for every registered metric."""
+    lines = []
+    seen = set()
+    for metric in sorted(registry, key=lambda m: m.name):
+        if metric.name not in seen:
+            seen.add(metric.name)
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for name, value in metric.samples():
+            lines.append('{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
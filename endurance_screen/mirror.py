@@ -0,0 +1,156 @@
+"""
+Replica servers (``endure-server --replica-of URL``).
+
+A replica serves the same pages and API as the primary from a local copy of
+each plan, so screens on the far side of the house can use a nearby box.
+Each plan it is asked for follows the primary through the primary's own
+/api/poll and /api/reminders. Versions are the primary's, so a screen can
+move between servers without a spurious reload. Writes, history, stats and
+the adherence timeline are forwarded to the primary, which keeps the
+conflict checks in one place. Only plans the primary has are mirrored.
+
+This reuses the worker replica from ``--workers``, with the primary's HTTP
+API standing in for the hub.
+"""
+import threading
+import time
+
+from . import adherence
+from . import main as server
+from .transport import Client
+from .workers import ReplicaStore
+
+POLL_TIMEOUT = 300
+REQUEST_TIMEOUT = 30
+RETRY_MIN = 1
+RETRY_MAX = 60
+
+
+class PrimaryUnavailable(RuntimeError):
+    """The primary couldn't be reached or gave a bad answer."""
+
+
+class Primary:
+    """The hub protocol ReplicaStore speaks, carried over the primary's HTTP API."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+
+    def client(self):
+        # http.client connections aren't shareable, so one per thread
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(self.url, timeout=REQUEST_TIMEOUT)
+        return client
+
+    def plan_url(self, name, route):
+        return self.url + ('' if name is None else '/p/' + name) + route
+
+    def plan_message(self, name):
+        status, data = self.client().get(self.plan_url(name, '/api/reminders'), ok=(200, 404))
+        if status == 404:
+            # A plan being created through us: empty until the first save reaches the primary
+            return {'name': name, 'content': '', 'version': 0, 'text_version': 0, 'modified': time.time()}
+        # Primaries from before text versions were exposed
+        data.setdefault('text_version', data['version'])
+        data.setdefault('modified', time.time())
+        return dict(data, name=name)
+
+    def request(self, message):
+        try:
+            return self.forward(message)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            raise PrimaryUnavailable('primary {}: {}'.format(self.url, e))
+
+    def forward(self, message):
+        op, name = message['op'], message.get('name')
+        client = self.client()
+        reminders = self.plan_url(name, '/api/reminders')
+        if op == 'exists':
+            status, _ = client.get(reminders, ok=(200, 404))
+            return {'exists': status == 200}
+        if op == 'get':
+            return self.plan_message(name)
+        if op == 'write':
+            status, _ = client.post(reminders, {'content': message['content'], 'hash': message.get('base_hash'),
+                                                'version': message.get('base_version')}, ok=(200, 409))
+            return dict(self.plan_message(name), conflict=status == 409)
+        if op == 'patch':
+            status, data = client.post(reminders, {'patch': message['patch'], 'version': message['base_version']},
+                                       ok=(200, 400, 409))
+            reply = self.plan_message(name)
+            if status == 400:
+                reply['patch_error'] = data.get('error')
+            elif status == 409:
+                reply.update(conflict=True, conflicts=data.get('conflicts'))
+            else:
+                reply['merged'] = data.get('merged', False)
+            return reply
+        if op == 'history':
+            _, data = client.get(self.plan_url(name, '/api/history'), params={'limit': message.get('limit')})
+            return data
+        if op == 'stats':
+            _, data = client.get(self.plan_url(name, '/api/stats'))
+            return {'stats': data}
+        if op == 'version':
+            status, data = client.get(self.plan_url(name, '/api/version/{}'.format(message['version'])),
+                                      ok=(200, 404))
+            return {'content': data.get('content') if status == 200 else None}
+        if op == 'timeline':
+            _, data = client.get(self.plan_url(name, '/api/timeline'),
+                                 params={'from': message['from'], 'to': message['to'],
+                                         'curve': 1 if message['curve'] else None})
+            return data
+        raise ValueError('unknown op ' + op)
+
+
+class MirrorStore(ReplicaStore):
+    """A plan mirrored from the primary, kept fresh by a long-poll of its own."""
+
+    def __init__(self, name, path, primary):
+        super().__init__(name, path, primary)
+        thread = threading.Thread(target=self.follow, name='mirror-{}'.format(name or 'default'), daemon=True)
+        thread.start()
+
+    def adherence(self, first, last, with_curve=False):
+        # The primary keeps the history
+        return self.hub.request({'op': 'timeline', 'name': self.name, 'from': adherence.iso(first),
+                                 'to': adherence.iso(last), 'curve': with_curve})['days']
+
+    def follow(self):
+        client = Client(self.hub.url, timeout=POLL_TIMEOUT + REQUEST_TIMEOUT)
+        delay = RETRY_MIN
+        while True:
+            plan = self._plan
+            # A plan our own write installed isn't announced yet, so ask as if we didn't have it
+            known = plan.version if plan is not None and self.quiet is None else 0
+            try:
+                _, data = client.get(self.hub.plan_url(self.name, '/api/poll'),
+                                     params={'version': known, 'timeout': POLL_TIMEOUT})
+                if data.get('changed'):
+                    self.adopt(self.hub.request({'op': 'get', 'name': self.name}), fresh=True)
+                    current = self._plan
+                    if known and current is not None and current.version == plan.version:
+                        # "Changed" but nothing new to fetch: don't spin on it
+                        time.sleep(delay)
+                        delay = min(delay * 2, RETRY_MAX)
+                        continue
+                delay = RETRY_MIN
+            except (OSError, ValueError, PrimaryUnavailable):
+                # Keep serving the copy we have while the primary is away
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX)
+
+
+def primary_unavailable(error):
+    return server.jsonify({'error': str(error)}), 503
+
+
+def configure(url):
+    """Make every plan this process serves a mirror of the same plan on `url`."""
+    primary = Primary(url)
+    server.store_factory = lambda name, path: MirrorStore(name, path, primary)
+    # Every mirrored plan keeps a poll parked on the primary, so only follow plans it has
+    server.plan_exists = lambda name, path: primary.request({'op': 'exists', 'name': name})['exists']
+    server.app.register_error_handler(PrimaryUnavailable, primary_unavailable)
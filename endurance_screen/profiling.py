@@ -0,0 +1,154 @@
+"""
+Opt-in request profiling for endure-server (``endure-server --profile``).
+
+Every request gets a ``Server-Timing`` header splitting its time into file
+I/O, parsing, hashing, rendering and (for /api/poll) waiting. With
+--profile-dir, a sample of requests also runs under cProfile and the dumps
+of the N slowest are kept in that directory. ``endure-profile DIR`` merges
+them into one pstats report.
+
+Phases are tracked in a context variable, so they follow the request in
+both the threaded server and the asyncio engine.
+"""
+import argparse
+import contextvars
+import cProfile
+import heapq
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = False
+PROFILE_DIR = None
+KEEP = 20
+SAMPLE = 1.0
+
+PHASES = ('io', 'parse', 'hash', 'render', 'wait')
+
+current = contextvars.ContextVar('endure_request_profile', default=None)
+
+slowest = []          # min-heap of (busy seconds, dump path)
+slowest_lock = threading.Lock()
+dump_counter = 0
+
+
+def configure(enabled, directory=None, keep=KEEP, sample=SAMPLE):
+    global ENABLED, PROFILE_DIR, KEEP, SAMPLE
+    ENABLED = enabled or directory is not None
+    PROFILE_DIR = directory
+    KEEP = keep
+    SAMPLE = sample
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+
+class RequestProfile:
+    def __init__(self, label, profile):
+        self.label = label
+        self.phases = {}
+        self.profiler = None
+        if profile:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active in this thread
+                profiler = None
+            self.profiler = profiler
+        self.start = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def finish(self):
+        total = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            keep_dump(self.profiler, self.label, total - self.phases.get('wait', 0))
+
+        parts = ['{};dur={:.3f}'.format(name, self.phases[name] * 1000)
+                 for name in PHASES if name in self.phases]
+        parts.append('total;dur={:.3f}'.format(total * 1000))
+        return ', '.join(parts)
+
+
+def begin(label, profile=True):
+    """Start timing the current request; cProfile it too if sampled."""
+    profile = profile and PROFILE_DIR is not None and random.random() < SAMPLE
+    current.set(RequestProfile(label, profile))
+
+
+def end():
+    """Stop timing the current request and return its Server-Timing value, if any."""
+    request = current.get()
+    if request is None:
+        return None
+    current.set(None)
+    return request.finish()
+
+
+@contextmanager
+def phase(name):
+    request = current.get()
+    if request is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request.add(name, time.perf_counter() - start)
+
+
+def keep_dump(profiler, label, busy):
+    """Write the dump if this is one of the KEEP slowest requests so far."""
+    global dump_counter
+    with slowest_lock:
+        if len(slowest) >= KEEP and busy <= slowest[0][0]:
+            return
+        dump_counter += 1
+        name = '{:010.3f}ms-{}-{}-{}.prof'.format(busy * 1000, re.sub(r'[^\w.-]+', '_', label).strip('_'),
+                                                 os.getpid(), dump_counter)
+        path = os.path.join(PROFILE_DIR, name)
+        profiler.dump_stats(path)
+        heapq.heappush(slowest, (busy, path))
+        if len(slowest) > KEEP:
+            _, dropped = heapq.heappop(slowest)
+            try:
+                os.remove(dropped)
+            except OSError:
+                pass
+
+
+# --- SUMMARY CLI ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise endure-server --profile-dir dumps")
+    parser.add_argument('directory', help='Directory passed to endure-server --profile-dir')
+    parser.add_argument('--sort', default='cumulative', help='pstats sort key (cumulative, tottime, calls, ...)')
+    parser.add_argument('--limit', type=int, default=25, help='Functions to show')
+    parser.add_argument('--filter', help='Only show functions matching this regex, e.g. "parse|render"')
+    args = parser.parse_args()
+
+    dumps = sorted((f for f in os.listdir(args.directory) if f.endswith('.prof')), reverse=True)
+    if not dumps:
+        print("No profiles in {}".format(args.directory))
+        return
+
+    print("{} requests profiled, slowest first:".format(len(dumps)))
+    for name in dumps:
+        print("  " + name)
+    print()
+
+    stats = pstats.Stats(*[os.path.join(args.directory, name) for name in dumps])
+    stats.strip_dirs().sort_stats(args.sort)
+    restrictions = [args.filter] if args.filter else []
+    stats.print_stats(*restrictions, args.limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Registry of the screens connected to this server (``/api/screens``).
+
+Screen pages send a random id, kept in localStorage, with every poll and
+stream request. For each id the server keeps one fixed-size record: when the
+screen was last seen, the version it has, how often it reconnects, how long
+its polls park and how long it takes from a plan being announced to the
+screen coming back with it. At most LIMIT screens are remembered; the one
+seen longest ago is forgotten first.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+LIMIT = 1000
+# A poll arriving this long after the previous answer means the screen lost us for a while
+RECONNECT_GAP = 3.0
+# Weight of the newest sample in running averages
+SMOOTHING = 0.2
+# Reconnect rates are taken over at least this long, so a new screen's first retry isn't 3600/hour
+MIN_RATE_WINDOW = 600
+
+CLIENT_RE = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+AGENT_LENGTH = 120
+
+
+def smooth(average, sample):
+    return sample if average is None else average + SMOOTHING * (sample - average)
+
+
+class Screen:
+    __slots__ = ('id', 'plan', 'address', 'agent', 'first_seen', 'last_seen', 'ended', 'open',
+                 'version', 'requests', 'reconnects', 'parked', 'updates', 'latency', 'latency_last',
+                 'latency_max')
+
+    def __init__(self, client_id, now):
+        self.id = client_id
+        self.plan = self.address = self.agent = None
+        self.first_seen = self.last_seen = now
+        self.ended = None           # when its last request finished
+        self.open = 0               # requests in progress
+        self.version = None
+        self.requests = self.reconnects = self.updates = 0
+        self.parked = self.latency = self.latency_last = self.latency_max = None
+
+    def summary(self, now, wall):
+        window = max(now - self.first_seen, MIN_RATE_WINDOW)
+        return {
+            'id': self.id,
+            'plan': self.plan,
+            'address': self.address,
+            'agent': self.agent,
+            'connected': self.open > 0,
+            'last_seen': wall - (now - self.last_seen),
+            'version': self.version,
+            'requests': self.requests,
+            'reconnects': self.reconnects,
+            'reconnects_per_hour': round(self.reconnects * 3600 / window, 2),
+            'parked_seconds': self.parked,
+            'updates': self.updates,
+            'latency_seconds': {'avg': self.latency, 'last': self.latency_last, 'max': self.latency_max},
+        }
+
+
+class Registry:
+    def __init__(self, limit=LIMIT):
+        self.limit = limit
+        self.screens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def connect(self, client_id, plan, address, agent, version, notified, resumed=False):
+        """Note a poll or stream starting. Returns its Screen, or None without a usable id.
+
+        `version` is what the screen says it has, and `notified` the store's
+        last announcement, as (version, monotonic time). `resumed` marks a
+        stream the browser reopened on its own.
+        """
+        if not client_id or not CLIENT_RE.match(client_id):
+            return None
+        now = time.monotonic()
+        with self.lock:
+            screen = self.screens.get(client_id)
+            if screen is None:
+                screen = self.screens[client_id] = Screen(client_id, now)
+                if len(self.screens) > self.limit:
+                    self.screens.popitem(last=False)
+            else:
+                self.screens.move_to_end(client_id)
+                if resumed or screen.open or now - screen.ended > RECONNECT_GAP:
+                    screen.reconnects += 1
+            screen.plan = plan
+            screen.address = address
+            screen.agent = agent[:AGENT_LENGTH] if agent else None
+            screen.requests += 1
+            screen.last_seen = now
+            self._seen(screen, version, notified, now)
+            screen.open += 1
+        return screen
+
+    def seen(self, screen, version, notified):
+        """The screen now has `version`, e.g. a stream has just sent it."""
+        if screen is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            screen.last_seen = now
+            self._seen(screen, version, notified, now)
+
+    def _seen(self, screen, version, notified, now):
+        previous, screen.version = screen.version, version
+        if version is None or previous is None or version <= previous:
+            return
+        if notified is None or notified[0] != version:
+            return
+        # Only a screen that was listening when the plan was announced says
+        # anything about update latency; one back from a long sleep doesn't
+        announced = notified[1]
+        if screen.open or (screen.ended is not None and screen.ended >= announced):
+            latency = now - announced
+            screen.updates += 1
+            screen.latency = smooth(screen.latency, latency)
+            screen.latency_last = latency
+            screen.latency_max = max(screen.latency_max or 0, latency)
+
+    def disconnect(self, screen, parked=None):
+        """Note a request ending; `parked` is how long a poll waited for a change."""
+        if screen is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            screen.open -= 1
+            screen.ended = screen.last_seen = now
+            if parked is not None:
+                screen.parked = smooth(screen.parked, parked)
+
+    def report(self):
+        """Every remembered screen, slowest to update first."""
+        now, wall = time.monotonic(), time.time()
+        with self.lock:
+            screens = [screen.summary(now, wall) for screen in self.screens.values()]
+        screens.sort(key=lambda s: s['latency_seconds']['avg'] or 0, reverse=True)
+        return {'limit': self.limit, 'count': len(screens), 'screens': screens}
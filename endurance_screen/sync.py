@@ -0,0 +1,196 @@
+"""
+Two-way sync between a local file and a plan (``endure URL --sync FILE``).
+
+Local saves are pushed as patches, so they merge with anything saved on
+the server meanwhile. Remote changes arrive over the server's long-poll and
+are written to the file. A file that already differs from the server when
+the sync starts is set aside as FILE.conflict, unless it is asked to be
+pushed. Each direction keeps one keep-alive connection
+open for the whole session. All file and server updates happen on the main
+thread; the poller only says that something changed.
+"""
+import hashlib
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+from .delta import make_patch
+from .transport import Client
+
+POLL_TIMEOUT = 300
+CHECK_INTERVAL = 0.5
+RETRY_DELAY = 5
+
+
+def md5(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def file_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def read_file(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def write_file(path, content):
+    """Replace `path` in one step so editors and scripts never see half a plan."""
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class PlanSync:
+    def __init__(self, url, path, push_local=False):
+        self.url = url
+        self.poll_url = url[:-len('/api/reminders')] + '/api/poll'
+        self.path = path
+        self.push_local = push_local
+        self.client = Client(url)
+        self.base = None          # text both sides last agreed on
+        self.version = None       # server version of `base`
+        self.hash = None
+        self.features = []
+        self.key = None           # stat of the file when we last read or wrote it
+        self.remote_changed = threading.Event()
+
+    # --- SERVER ---
+
+    def fetch(self):
+        status, data = self.client.get(self.url, ok=(200, 404))
+        if status == 404:
+            # A named plan nobody has saved yet: the first push creates it
+            return None, None, []
+        return data['content'], data['version'], data.get('features', [])
+
+    def push(self, content):
+        """Send local edits. Returns False if they clashed with changes on the server."""
+        if 'patch' in self.features:
+            payload = {'patch': make_patch(self.base, content), 'version': self.version}
+        else:
+            payload = {'content': content, 'hash': self.hash}
+        status, data = self.client.post(self.url, payload, ok=(200, 409))
+        if status == 409:
+            return False
+        if data.get('merged') or 'version' not in data:
+            self.pull()
+        else:
+            self.agree(content, data['version'])
+        return True
+
+    def pull(self, overwrite=False):
+        """Bring the file up to date with the server, unless it has unpushed edits."""
+        content, version, self.features = self.fetch()
+        if content is None:
+            return
+        if content != self.base or overwrite:
+            if not overwrite and self.key != file_key(self.path):
+                # Edited locally since we last looked; push those first
+                return
+            write_file(self.path, content)
+            self.key = file_key(self.path)
+            print("↓ Updated {} from the server".format(self.path))
+        self.agree(content, version)
+
+    def agree(self, content, version):
+        self.base = content
+        # With no plan on the server yet, the first push mustn't check against one
+        self.hash = md5(content) if version is not None else None
+        self.version = version
+
+    def poll(self):
+        """Long-poll in the background and flag remote changes for the main loop."""
+        client = Client(self.poll_url, timeout=POLL_TIMEOUT + 30)
+        version = 0
+        while True:
+            version = max(version, self.version or 0)
+            try:
+                _, data = client.get(self.poll_url, params={'version': version, 'timeout': POLL_TIMEOUT})
+            except (OSError, ValueError):
+                time.sleep(RETRY_DELAY)
+                continue
+            if data.get('changed'):
+                version = data['version']
+                if data.get('hash') != self.hash:
+                    self.remote_changed.set()
+
+    # --- LOCAL ---
+
+    def check_local(self):
+        key = file_key(self.path)
+        if key is None or key == self.key:
+            return
+        content = read_file(self.path)
+        self.key = key
+        if content == self.base:
+            return
+        if self.push(content):
+            print("↑ Saved {} to the server".format(self.path))
+            return
+
+        kept = self.path + '.conflict'
+        write_file(kept, content)
+        print("⚠️  CONFLICT: the server changed the same lines. Your version is in {}".format(kept),
+              file=sys.stderr)
+        self.pull(overwrite=True)
+
+    def start(self):
+        content, version, self.features = self.fetch()
+        local = read_file(self.path) if os.path.exists(self.path) else None
+        if content is None:
+            print("There is no such plan yet; saving {} will create it.".format(self.path))
+            content = ''
+        if local is not None and local != content and (self.push_local or version is None):
+            # The local file is treated as an edit of what the server has now
+            self.agree(content, version)
+        else:
+            if local is not None and local != content:
+                # It may be stale, so it mustn't undo what was saved elsewhere
+                kept = self.path + '.conflict'
+                write_file(kept, local)
+                print("⚠️  {} differed from the server. It now has the server's plan; yours is in {}"
+                      .format(self.path, kept), file=sys.stderr)
+            write_file(self.path, content)
+            self.key = file_key(self.path)
+            self.agree(content, version)
+        threading.Thread(target=self.poll, name='endure-poll', daemon=True).start()
+
+    def run(self):
+        self.start()
+        print("Syncing {} with {} (Ctrl-C to stop)".format(self.path, self.url))
+        while True:
+            try:
+                self.check_local()
+                if self.remote_changed.wait(CHECK_INTERVAL):
+                    self.remote_changed.clear()
+                    self.pull()
+            except (OSError, ValueError) as e:
+                print("Server unreachable ({}), retrying...".format(e), file=sys.stderr)
+                time.sleep(RETRY_DELAY)
+
+
+def sync(url, path, push_local=False):
+    try:
+        PlanSync(url, path, push_local).run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,276 @@
+"""
+Date-aware timeline of plan entries.
+
+A plan line's time can be plain ``HH:MM`` (every day), weekday-qualified
+(``Mon,Thu 08:00``), dated (``2026-10-18 08:00``) or a dated range
+(``2026-10-18..2026-10-24 08:00``, every day in the range).
+
+Recurring entries are indexed per weekday and dated ones by absolute minute,
+each as sorted ``array`` columns with running calorie totals. "Consumed
+today", "next N from now" and "how many more" are then a few bisects no
+matter how many entries the plan has. An edit to the plan only moves the
+entries it changed (see Timeline.updated).
+"""
+import bisect
+import itertools
+import re
+from array import array
+from datetime import date, datetime, timedelta
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+MINUTES_PER_DAY = 24 * 60
+# Longest a dated range may run; longer ones are ignored like any bad line
+MAX_RANGE_DAYS = 366
+
+TIME_RE = re.compile(r'^(\d{1,2}):(\d{1,2})$', re.ASCII)
+DATED_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})(?:\s*\.\.\s*(\d{4}-\d{2}-\d{2}))?\s+(\S+)$')
+WEEKLY_RE = re.compile(r'^([a-z]{3}(?:\s*,\s*[a-z]{3})*)\s+(\S+)$', re.IGNORECASE)
+
+
+class Entry:
+    """One plan line. `first_day`/`last_day` are date ordinals for dated entries."""
+
+    __slots__ = ('time_str', 'minute', 'description', 'calories', 'weekdays', 'first_day', 'last_day')
+
+    def __init__(self, time_str, minute, description, calories, weekdays=None, first_day=None, last_day=None):
+        self.time_str = time_str
+        self.minute = minute
+        self.description = description
+        self.calories = calories
+        self.weekdays = weekdays
+        self.first_day = first_day
+        self.last_day = last_day
+
+
+def parse_time(text):
+    """Minute of day for `H:MM`/`HH:MM` (what strptime's %H:%M takes), else None."""
+    match = TIME_RE.match(text)
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def parse_entry(when, description, calories):
+    """An Entry for the text left of the `|`, or None if it isn't a time."""
+    minute = parse_time(when)
+    if minute is not None:
+        return Entry(when, minute, description, calories)
+
+    match = DATED_RE.match(when)
+    if match:
+        first, last, time_str = match.groups()
+        minute = parse_time(time_str)
+        try:
+            first_day = date.fromisoformat(first).toordinal()
+            last_day = date.fromisoformat(last).toordinal() if last else first_day
+        except ValueError:
+            return None
+        if minute is None or not 0 <= last_day - first_day < MAX_RANGE_DAYS:
+            return None
+        return Entry(time_str, minute, description, calories, first_day=first_day, last_day=last_day)
+
+    match = WEEKLY_RE.match(when)
+    if match:
+        names, time_str = match.groups()
+        minute = parse_time(time_str)
+        try:
+            weekdays = frozenset(WEEKDAYS.index(name.strip().lower()) for name in names.split(','))
+        except ValueError:
+            return None
+        if minute is None:
+            return None
+        return Entry(time_str, minute, description, calories, weekdays=weekdays)
+
+    return None
+
+
+def sort_key(occurrence):
+    # Same-minute entries go by description so an edited plan and a fresh
+    # parse of the same text always agree on their order
+    key, entry = occurrence
+    return key, entry.description
+
+
+def entry_calories(entry):
+    return entry.calories
+
+
+class Track:
+    """Sorted occurrence keys, the entry behind each and running calorie totals."""
+
+    __slots__ = ('keys', 'items', 'cumulative')
+
+    def __init__(self, occurrences=()):
+        occurrences = sorted(occurrences, key=sort_key)
+        self.keys = array('q', (key for key, _ in occurrences))
+        self.items = [entry for _, entry in occurrences]
+        self.cumulative = None
+        self.retotal(0)
+
+    def copy(self):
+        track = Track.__new__(Track)
+        track.keys = array('q', self.keys)
+        track.items = list(self.items)
+        track.cumulative = array('q', self.cumulative)
+        return track
+
+    def retotal(self, start):
+        """Recompute running totals from position `start` on."""
+        if start == 0:
+            self.cumulative = array('q', itertools.accumulate(map(entry_calories, self.items), initial=0))
+            return
+        del self.cumulative[start + 1:]
+        tail = itertools.accumulate(map(entry_calories, self.items[start:]), initial=self.cumulative[start])
+        next(tail)
+        self.cumulative.extend(tail)
+
+    def insert(self, key, entry):
+        lo, hi = bisect.bisect_left(self.keys, key), bisect.bisect_right(self.keys, key)
+        while lo < hi and self.items[lo].description <= entry.description:
+            lo += 1
+        self.keys.insert(lo, key)
+        self.items.insert(lo, entry)
+        return lo
+
+    def remove(self, key, entry):
+        lo, hi = bisect.bisect_left(self.keys, key), bisect.bisect_right(self.keys, key)
+        for position in range(lo, hi):
+            if self.items[position] is entry:
+                del self.keys[position]
+                del self.items[position]
+                return position
+        raise ValueError('entry not in track')
+
+    def span(self, after, until):
+        """Positions of keys in (after, until]."""
+        return bisect.bisect_right(self.keys, after), bisect.bisect_right(self.keys, until)
+
+    def calories(self, after, until):
+        start, stop = self.span(after, until)
+        return self.cumulative[stop] - self.cumulative[start]
+
+
+# Track numbers 0-6 are the weekdays; dated occurrences live in the last one
+DATED = 7
+
+
+def placements(entry):
+    """(track number, key) for every occurrence of `entry`."""
+    if entry.first_day is not None:
+        return [(DATED, day * MINUTES_PER_DAY + entry.minute) for day in range(entry.first_day, entry.last_day + 1)]
+    weekdays = range(7) if entry.weekdays is None else sorted(entry.weekdays)
+    return [(weekday, entry.minute) for weekday in weekdays]
+
+
+class Timeline:
+    __slots__ = ('tracks', 'recurring')
+
+    def __init__(self, entries=()):
+        grouped = [[] for _ in range(DATED + 1)]
+        self.recurring = 0
+        for entry in entries:
+            self.recurring += entry.first_day is None
+            for track, key in placements(entry):
+                grouped[track].append((key, entry))
+        self.tracks = [Track(occurrences) for occurrences in grouped]
+
+    @property
+    def dated(self):
+        return self.tracks[DATED]
+
+    def updated(self, removed, added):
+        """A new Timeline with `removed` entries taken out and `added` put in.
+
+        Only the tracks the edit touches are copied, and only the entries that
+        changed are placed, so a small edit to a large plan stays cheap.
+        """
+        timeline = Timeline.__new__(Timeline)
+        timeline.tracks = list(self.tracks)
+        timeline.recurring = self.recurring
+        changed = {}
+
+        def edit(number, key, entry, insert):
+            if number not in changed:
+                timeline.tracks[number] = self.tracks[number].copy()
+                changed[number] = len(timeline.tracks[number].keys)
+            track = timeline.tracks[number]
+            position = track.insert(key, entry) if insert else track.remove(key, entry)
+            changed[number] = min(changed[number], position)
+
+        for entry in removed:
+            timeline.recurring -= entry.first_day is None
+            for number, key in placements(entry):
+                edit(number, key, entry, False)
+        for entry in added:
+            timeline.recurring += entry.first_day is None
+            for number, key in placements(entry):
+                edit(number, key, entry, True)
+        for number, start in changed.items():
+            timeline.tracks[number].retotal(start)
+        return timeline
+
+    def day_tracks(self, day, after):
+        """(track, lo, hi) key ranges covering occurrences on `day` after minute `after`."""
+        base = day * MINUTES_PER_DAY
+        return ((self.tracks[date.fromordinal(day).weekday()], after, MINUTES_PER_DAY - 1),
+                (self.dated, base + after, base + MINUTES_PER_DAY - 1))
+
+    def occurrences(self, day, after, limit=None):
+        """(minute, entry) for occurrences on `day` after minute `after`, in time order."""
+        found = []
+        for track, lo, hi in self.day_tracks(day, after):
+            start, stop = track.span(lo, hi)
+            if limit is not None:
+                stop = min(stop, start + limit)
+            offset = hi - MINUTES_PER_DAY + 1
+            found.extend((track.keys[k] - offset, track.items[k]) for k in range(start, stop))
+        found.sort(key=lambda occurrence: (occurrence[0], occurrence[1].description))
+        return found if limit is None else found[:limit]
+
+    def count(self, day, after):
+        total = 0
+        for track, lo, hi in self.day_tracks(day, after):
+            start, stop = track.span(lo, hi)
+            total += stop - start
+        return total
+
+    def consumed(self, day, minute):
+        """Calories of every occurrence on `day` up to and including `minute`."""
+        return sum(track.calories(lo, lo + minute + 1) for track, lo, _ in self.day_tracks(day, -1))
+
+    def next_day(self, day, horizon):
+        """The next day after `day` that can have occurrences, or None."""
+        if self.recurring and day < horizon:
+            return day + 1
+        # Past the horizon only dated entries are worth looking for
+        start = bisect.bisect_left(self.dated.keys, (day + 1) * MINUTES_PER_DAY)
+        if start == len(self.dated.keys):
+            return None
+        return self.dated.keys[start] // MINUTES_PER_DAY
+
+    def upcoming(self, now, count):
+        """The next `count` occurrences after `now` as (day, minute, entry)."""
+        day, after = now.toordinal(), now.hour * 60 + now.minute
+        # `count` weeks always holds `count` occurrences of anything recurring
+        horizon = day + 7 * count
+        found = []
+        while day is not None and len(found) < count:
+            found.extend((day, minute, entry) for minute, entry in self.occurrences(day, after, count - len(found)))
+            day, after = self.next_day(day, horizon), -1
+        return found
+
+
+def occurrence_time(day, minute):
+    return datetime.combine(date.fromordinal(day), datetime.min.time()) + timedelta(minutes=minute)
+
+
+def occurrence_label(entry, day, today):
+    """The entry's time as written, qualified with the day when it isn't today."""
+    if day == today:
+        return entry.time_str
+    if day - today < 7:
+        return '{} {}'.format(WEEKDAYS[date.fromordinal(day).weekday()].title(), entry.time_str)
+    return '{} {}'.format(date.fromordinal(day).isoformat(), entry.time_str)
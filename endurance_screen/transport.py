@@ -0,0 +1,101 @@
+"""
+Small JSON-over-HTTP client for the endure CLI, on the standard library.
+
+Importing requests costs more than the rest of a CLI run, so the CLI talks
+to the server through http.client instead. A Client keeps its connection
+open, so a fetch and the push that follows it share one TCP connection.
+"""
+import http.client
+import json
+import os
+from urllib.parse import urlencode, urlsplit
+
+
+class HTTPError(OSError):
+    """The server answered with an unexpected status."""
+
+    def __init__(self, status, reason, url):
+        super().__init__('{} {} for {}'.format(status, reason, url))
+        self.status = status
+
+
+class ProtocolError(OSError):
+    """The server's reply wasn't valid HTTP, or the connection broke partway through it."""
+
+
+class Client:
+    def __init__(self, url, timeout=None):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self):
+        host = self.netloc
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def request(self, method, url, payload=None, params=None, ok=(200,), body=None, content_type=None):
+        """Send a request and return (status, decoded JSON body).
+
+        The body is `payload` as JSON, or `body` as is; an open file is
+        streamed from disk. A connection the server has closed since the
+        last request is reopened once. Statuses outside `ok` raise HTTPError.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if params:
+            path += '?' + urlencode({k: v for k, v in params.items() if v is not None})
+        headers = {'Accept': 'application/json'}
+        if payload is not None:
+            body = json.dumps(payload).encode('utf-8')
+            content_type = 'application/json'
+        if content_type:
+            headers['Content-Type'] = content_type
+        if hasattr(body, 'fileno'):
+            headers['Content-Length'] = str(os.fstat(body.fileno()).st_size)
+
+        for attempt in (0, 1):
+            if self.connection is None:
+                self.connection = self.connect()
+            if hasattr(body, 'seek'):
+                body.seek(0)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt:
+                    raise
+            except OSError:
+                # A connection left mid-request can't be used again
+                self.close()
+                raise
+            except http.client.HTTPException as e:
+                # Not OSErrors, but callers handle every network failure as one
+                self.close()
+                raise ProtocolError('bad response from {}: {!r}'.format(url, e)) from e
+        if response.will_close:
+            self.close()
+
+        if response.status not in ok:
+            raise HTTPError(response.status, response.reason, url)
+        return response.status, json.loads(data) if data else None
+
+    def get(self, url, params=None, ok=(200,)):
+        return self.request('GET', url, params=params, ok=ok)
+
+    def post(self, url, payload, ok=(200,)):
+        return self.request('POST', url, payload=payload, ok=ok)
+
+    def upload(self, url, f, content_type, params=None, ok=(200,)):
+        return self.request('POST', url, params=params, ok=ok, body=f, content_type=content_type)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
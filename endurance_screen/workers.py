@@ -0,0 +1,317 @@
+"""
+Multi-process mode for endure-server (``endure-server --workers N``).
+
+The supervisor process owns every plan: it reads and writes the files, runs
+the watcher and the boundary scheduler, and hands out versions. It serves
+those plans to the workers over a Unix socket (the "hub"). Workers answer
+HTTP on a shared listening socket and keep an in-memory replica of each
+plan they have been asked for. Writes go through the hub, and every change
+is pushed to all workers, so a save handled by one worker wakes screens
+parked on any of them. Versions stay identical across workers.
+"""
+import json
+import os
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import main as server
+
+
+def plan_message(store):
+    plan = store.get()
+    return {
+        'name': store.name,
+        'content': plan.content,
+        'version': plan.version,
+        'text_version': plan.text_version,
+        'modified': plan.modified,
+    }
+
+
+def send(wfile, message):
+    wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+    wfile.flush()
+
+
+# --- SUPERVISOR SIDE ---
+
+class HubHandler(socketserver.StreamRequestHandler):
+    """One connection from a worker: either a subscription or a single request."""
+
+    def handle(self):
+        for line in self.rfile:
+            message = json.loads(line)
+            op = message.get('op')
+            if op == 'subscribe':
+                self.server.hub.subscribe(self)
+                continue
+
+            # Workers only hold stores for plans that exist or are being saved
+            store = server.get_store(message.get('name'), create=op != 'exists')
+            if op == 'exists':
+                send(self.wfile, {'exists': store is not None})
+            elif store is None:
+                send(self.wfile, {'error': 'no such plan'})
+            elif op == 'get':
+                send(self.wfile, plan_message(store))
+            elif op == 'write':
+                try:
+                    store.write(message.get('content', ''), message.get('base_version'), message.get('base_hash'))
+                except server.PlanConflict:
+                    send(self.wfile, dict(plan_message(store), conflict=True))
+                else:
+                    send(self.wfile, plan_message(store))
+            elif op == 'patch':
+                try:
+                    merged = store.patch(message['patch'], message['base_version'])
+                except server.PlanConflict as e:
+                    send(self.wfile, dict(plan_message(store), conflict=True, conflicts=e.conflicts))
+                except server.delta.PatchError as e:
+                    send(self.wfile, dict(plan_message(store), patch_error=str(e)))
+                else:
+                    send(self.wfile, dict(plan_message(store), merged=merged))
+            elif op == 'history':
+                send(self.wfile, {'versions': store.history(message.get('limit'))})
+            elif op == 'stats':
+                # Coalescing happens here, so the hub's window is the one that applies
+                send(self.wfile, {'stats': dict(store.get_stats(), coalesce_window=server.COALESCE_WINDOW)})
+            elif op == 'version':
+                send(self.wfile, {'content': store.content_at(message['version'])})
+            else:
+                send(self.wfile, {'error': 'unknown op'})
+
+    def finish(self):
+        self.server.hub.unsubscribe(self)
+        super().finish()
+
+
+class HubServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Hub:
+    """Owns the plans in the supervisor and pushes every change to the workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.server = HubServer(path, HubHandler)
+        self.server.hub = self
+        self.factory = server.store_factory
+
+    def make_store(self, name, path):
+        store = self.factory(name, path)
+        store.listeners.append(lambda: self.broadcast(store))
+        return store
+
+    def subscribe(self, handler):
+        with self.lock:
+            self.subscribers.add(handler)
+
+    def unsubscribe(self, handler):
+        with self.lock:
+            self.subscribers.discard(handler)
+
+    def broadcast(self, store):
+        line = (json.dumps(plan_message(store)) + '\n').encode('utf-8')
+        with self.lock:
+            for handler in list(self.subscribers):
+                try:
+                    handler.wfile.write(line)
+                    handler.wfile.flush()
+                except OSError:
+                    self.subscribers.discard(handler)
+
+    def start(self):
+        server.store_factory = self.make_store
+        thread = threading.Thread(target=self.server.serve_forever, name='hub', daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def supervise(args):
+    """Start the hub, bind the port once and keep N workers running on it."""
+    directory = tempfile.mkdtemp(prefix='endure-')
+    hub_path = os.path.join(directory, 'hub.sock')
+    hub = Hub(hub_path)
+    hub.start()
+
+    listener = socket.create_server((args.host, args.port), backlog=1024)
+    listener.set_inheritable(True)
+    fd = listener.fileno()
+
+    command = [sys.executable, '-c', 'from endurance_screen.main import main; main()',
+               '--host', args.host, '--port', str(args.port),
+               '--hub', hub_path, '--worker-fd', str(fd), '--adherence-db', args.adherence_db]
+    if args.use_async:
+        command.append('--async')
+    if args.profile:
+        command.append('--profile')
+    if args.profile_dir:
+        command += ['--profile-dir', args.profile_dir, '--profile-keep', str(args.profile_keep),
+                    '--profile-sample', str(args.profile_sample)]
+
+    def spawn():
+        return subprocess.Popen(command, pass_fds=[fd])
+
+    processes = [spawn() for _ in range(args.workers)]
+    try:
+        while True:
+            time.sleep(1)
+            for i, process in enumerate(processes):
+                if process.poll() is not None:
+                    print("Worker {} exited with {}, restarting".format(process.pid, process.returncode))
+                    processes[i] = spawn()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        hub.shutdown()
+        listener.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# --- WORKER SIDE ---
+
+class HubClient:
+    def __init__(self, path):
+        self.path = path
+
+    def request(self, message):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(self.path)
+            with conn.makefile('rwb') as f:
+                send(f, message)
+                reply = json.loads(f.readline())
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def subscribe(self):
+        """Apply every change the hub pushes to the plans this worker holds."""
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self.path)
+        f = conn.makefile('rwb')
+        send(f, {'op': 'subscribe'})
+
+        def loop():
+            for line in f:
+                message = json.loads(line)
+                store = server.stores.get(message['name'])
+                if store is not None:
+                    store.adopt(message)
+            # The supervisor went away; a worker without it is stale
+            os._exit(1)
+
+        thread = threading.Thread(target=loop, name='hub-subscriber', daemon=True)
+        thread.start()
+        return thread
+
+
+class ReplicaStore(server.PlanStore):
+    """A worker's copy of one plan. The hub owns the file and the versions."""
+
+    def __init__(self, name, path, hub):
+        super().__init__(name, path)
+        self.hub = hub
+        # Version installed from our own write's reply and not yet announced
+        self.quiet = None
+
+    def get(self):
+        plan = self._plan
+        if plan is None:
+            self.adopt(self.hub.request({'op': 'get', 'name': self.name}))
+            plan = self._plan
+        return plan
+
+    def write(self, content, base_version=None, base_hash=None):
+        reply = self.hub.request({'op': 'write', 'name': self.name, 'content': content,
+                                  'base_version': base_version, 'base_hash': base_hash})
+        self.adopt(reply, announce=False)
+        if reply.get('conflict'):
+            raise server.PlanConflict(self.get())
+
+    def patch(self, patch, base_version):
+        reply = self.hub.request({'op': 'patch', 'name': self.name, 'patch': patch, 'base_version': base_version})
+        self.adopt(reply, announce=False)
+        if reply.get('patch_error'):
+            raise server.delta.PatchError(reply['patch_error'])
+        if reply.get('conflict'):
+            raise server.PlanConflict(self.get(), reply.get('conflicts'))
+        return reply['merged']
+
+    def history(self, limit=None):
+        return self.hub.request({'op': 'history', 'name': self.name, 'limit': limit})['versions']
+
+    def get_stats(self):
+        return self.hub.request({'op': 'stats', 'name': self.name})['stats']
+
+    def content_at(self, version):
+        return self.hub.request({'op': 'version', 'name': self.name, 'version': version})['content']
+
+    def advance(self):
+        pass
+
+    def reload_if_changed(self):
+        return False
+
+    def adopt(self, message, fresh=False, announce=True):
+        """Install a plan pushed by the hub unless we already have it or newer.
+
+        A `fresh` message was fetched just now from the owner of the plan, so
+        it wins over ours whenever they differ, even if its version is lower
+        (the owner has restarted). Without `announce` (the reply to our own
+        write) waiting screens are left for the hub's notification, which
+        keeps to its coalescing window.
+        """
+        plan = server.Plan(message['content'], previous=self._plan)
+        plan.version = message['version']
+        plan.text_version = message['text_version']
+        plan.modified = message['modified']
+        with self.lock:
+            previous = self._plan
+            if previous is not None and (previous.version == plan.version if fresh
+                                         else previous.version >= plan.version):
+                # Already installed by the write's reply; this is the hub announcing it
+                wake = announce and self.quiet is not None and plan.version >= self.quiet
+                if wake:
+                    self.quiet = None
+            else:
+                self._plan = plan
+                wake = announce and previous is not None
+                self.quiet = None if announce else plan.version
+        if wake:
+            self.notify()
+
+
+def run_worker(args):
+    hub = HubClient(args.hub)
+    server.store_factory = lambda name, path: ReplicaStore(name, path, hub)
+    server.plan_exists = lambda name, path: hub.request({'op': 'exists', 'name': name})['exists']
+    hub.subscribe()
+
+    if args.use_async:
+        from . import aserver
+        aserver.serve(args.host, args.port, sock=socket.socket(fileno=args.worker_fd))
+        return
+
+    from werkzeug.serving import make_server
+    http = make_server(args.host, args.port, server.app, threaded=True, fd=args.worker_fd)
+    try:
+        http.serve_forever()
+    except KeyboardInterrupt:
+        pass
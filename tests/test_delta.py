@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+from endurance_screen import delta
+
+BASE = ''.join('line {}\n'.format(n) for n in range(10))
+
+
+def edited(text, changes):
+    """`text` with {line number: new line or None to delete} applied."""
+    lines = text.splitlines(keepends=True)
+    return ''.join(changes.get(n, line) for n, line in enumerate(lines) if changes.get(n, line) is not None)
+
+
+def random_edit(rng, text):
+    lines = text.splitlines(keepends=True)
+    for _ in range(rng.randint(1, 4)):
+        position = rng.randint(0, len(lines))
+        kind = rng.choice(('insert', 'delete', 'replace'))
+        if kind == 'insert' or not lines:
+            lines.insert(position, 'new {}\n'.format(rng.random()))
+        elif kind == 'delete':
+            del lines[min(position, len(lines) - 1)]
+        else:
+            lines[min(position, len(lines) - 1)] = 'changed {}\n'.format(rng.random())
+    return ''.join(lines)
+
+
+def test_patch_round_trip():
+    rng = random.Random(1)
+    for _ in range(200):
+        new = random_edit(rng, BASE)
+        assert delta.apply_patch(BASE, delta.make_patch(BASE, new)) == new
+
+
+def test_patch_keeps_missing_final_newline():
+    old, new = 'a\nb', 'a\nc'
+    assert delta.apply_patch(old, delta.make_patch(old, new)) == new
+
+
+@pytest.mark.parametrize('patch', [
+    'not a list',
+    [[0, 1]],
+    [[5, 4, []]],
+    [[0, 11, []]],
+    [[3, 4, []], [1, 2, []]],
+    [[0, 1, [1]]],
+])
+def test_check_patch_rejects(patch):
+    with pytest.raises(delta.PatchError):
+        delta.apply_patch(BASE, patch)
+
+
+def test_merge_separate_edits():
+    ours = edited(BASE, {1: 'ours\n'})
+    theirs = edited(BASE, {8: 'theirs\n', 5: None})
+    merged = delta.merge(BASE, theirs, delta.make_patch(BASE, ours))
+    assert merged == edited(BASE, {1: 'ours\n', 8: 'theirs\n', 5: None})
+
+
+def test_merge_is_symmetric():
+    rng = random.Random(2)
+    merges = 0
+    for _ in range(500):
+        ours, theirs = random_edit(rng, BASE), random_edit(rng, BASE)
+        try:
+            one = delta.merge(BASE, theirs, delta.make_patch(BASE, ours))
+        except delta.MergeConflict:
+            with pytest.raises(delta.MergeConflict):
+                delta.merge(BASE, ours, delta.make_patch(BASE, theirs))
+            continue
+        assert one == delta.merge(BASE, ours, delta.make_patch(BASE, theirs))
+        merges += 1
+    assert merges > 50
+
+
+def test_merge_conflict_on_same_line():
+    ours = edited(BASE, {3: 'ours\n'})
+    theirs = edited(BASE, {3: 'theirs\n'})
+    with pytest.raises(delta.MergeConflict) as raised:
+        delta.merge(BASE, theirs, delta.make_patch(BASE, ours))
+    [(mine, other)] = raised.value.hunks
+    assert mine == [3, 4, ['ours\n']]
+    assert other == [3, 4, ['theirs\n']]
+
+
+def test_merge_identical_change_is_not_a_conflict():
+    both = edited(BASE, {3: 'same\n'})
+    assert delta.merge(BASE, both, delta.make_patch(BASE, both)) == both
+
+
+def test_merge_inserts_at_same_place_conflict():
+    ours = BASE.replace('line 4\n', 'ours\nline 4\n')
+    theirs = BASE.replace('line 4\n', 'theirs\nline 4\n')
+    with pytest.raises(delta.MergeConflict):
+        delta.merge(BASE, theirs, delta.make_patch(BASE, ours))
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    ([2, 4, []], [4, 6, []], False),   # adjacent ranges
+    ([2, 4, []], [3, 5, []], True),    # overlapping ranges
+    ([3, 3, ['x']], [2, 5, []], True),  # insertion inside a replaced range
+    ([2, 2, ['x']], [2, 5, []], True),  # insertion where the other starts
+    ([5, 5, ['x']], [2, 5, []], False),  # insertion just after it
+])
+def test_clashes(a, b, expected):
+    assert delta.clashes(a, b) is expected
+    assert delta.clashes(b, a) is expected
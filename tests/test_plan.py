@@ -0,0 +1,97 @@
+import random
+from datetime import date, datetime, timedelta
+
+from endurance_screen.main import Plan
+
+TODAY = date.today()
+
+
+def day(offset):
+    return (TODAY + timedelta(days=offset)).isoformat()
+
+
+LINES = [
+    'Goal: Finish the ultra',
+    'Goal: Recover',
+    'Reason: Because it is there',
+    'Calorie Target: 2500',
+    'Calories: 1800',
+    '# a comment',
+    '',
+    'not a plan line',
+    '25:00 | not a time',
+    '07:00 | Oats (350 kcal)',
+    '07:00 | Coffee',
+    '12:30 | Lunch 600kcal',
+    '18:00 | Dinner (800 kcal)',
+    '23:59 | Late snack (100 kcal)',
+    '{} 09:00 | Race gel (100 kcal)'.format(day(0)),
+    '{} 06:00 | Tomorrow only (200 kcal)'.format(day(1)),
+    '{} 10:00 | Yesterday (50 kcal)'.format(day(-1)),
+    '{}..{} 08:15 | Taper week (150 kcal)'.format(day(-2), day(4)),
+    'Mon,Thu 19:00 | Gym shake (300 kcal)',
+    'Sat 10:00 | Long run fuel (800 kcal)',
+]
+
+
+def entry_key(entry):
+    return (entry.time_str, entry.minute, entry.description, entry.calories,
+            entry.weekdays and sorted(entry.weekdays), entry.first_day, entry.last_day)
+
+
+def summary(plan):
+    """Everything a parse decides, in a form that compares by value."""
+    parsed = [result if result is None or result[0] != 'entry' else ('entry', entry_key(result[1]))
+              for result in plan.parsed]
+    days = {}
+    for offset in range(-3, 10):
+        ordinal = TODAY.toordinal() + offset
+        days[offset] = ([(minute, entry_key(entry)) for minute, entry in plan.timeline.occurrences(ordinal, -1)],
+                        plan.timeline.consumed(ordinal, 12 * 60),
+                        plan.timeline.count(ordinal, 9 * 60))
+    now = datetime.combine(TODAY, datetime.min.time()).replace(hour=11)
+    upcoming = [(d, minute, entry_key(entry)) for d, minute, entry in plan.timeline.upcoming(now, 8)]
+    return plan.goal, plan.reason, plan.calorie_target, parsed, days, upcoming, plan.window(now, 5)
+
+
+def random_edit(rng, lines):
+    lines = list(lines)
+    kind = rng.choice(('insert', 'delete', 'replace', 'move', 'block'))
+    position = rng.randint(0, len(lines))
+    if kind == 'insert' or not lines:
+        lines.insert(position, rng.choice(LINES))
+    elif kind == 'delete':
+        del lines[min(position, len(lines) - 1)]
+    elif kind == 'replace':
+        lines[min(position, len(lines) - 1)] = rng.choice(LINES)
+    elif kind == 'move':
+        line = lines.pop(min(position, len(lines) - 1))
+        lines.insert(rng.randint(0, len(lines)), line)
+    else:
+        end = rng.randint(position, len(lines))
+        lines[position:end] = rng.sample(LINES, rng.randint(0, 4))
+    return lines
+
+
+def test_incremental_parse_matches_fresh_parse():
+    rng = random.Random(3)
+    lines = rng.sample(LINES, 10)
+    plan = Plan('\n'.join(lines) + '\n')
+    for _ in range(300):
+        lines = random_edit(rng, lines)
+        content = '\n'.join(lines) + '\n'
+        plan = Plan(content, previous=plan)
+        assert summary(plan) == summary(Plan(content))
+
+
+def test_incremental_parse_leaves_previous_plan_alone():
+    old = Plan('07:00 | Oats (350 kcal)\n12:30 | Lunch 600kcal\n')
+    before = summary(old)
+    Plan('07:00 | Oats (350 kcal)\n09:00 | Gel (100 kcal)\n', previous=old)
+    assert summary(old) == before
+
+
+def test_header_changes_are_picked_up_incrementally():
+    old = Plan('Goal: Run\nCalorie Target: 2000\n08:00 | Oats (300 kcal)\n')
+    new = Plan('Goal: Rest\nCalorie Target: 1500\n08:00 | Oats (300 kcal)\n', previous=old)
+    assert (new.goal, new.calorie_target) == ('Rest', 1500)
@@ -0,0 +1,118 @@
+import pytest
+
+from endurance_screen import adherence, delta, main
+from endurance_screen.main import PlanConflict, PlanStore
+
+PLAN = ''.join('{:02d}:00 | Meal {} ({} kcal)\n'.format(hour, hour, hour * 10) for hour in range(6, 16))
+
+
+@pytest.fixture(autouse=True)
+def adherence_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'ADHERENCE', adherence.AdherenceLog(str(tmp_path / 'adherence.sqlite3')))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'reminders.txt')
+
+
+@pytest.fixture
+def store(path):
+    store = PlanStore(None, path)
+    store.write(PLAN)
+    return store
+
+
+def replace_line(text, number, line):
+    lines = text.splitlines(keepends=True)
+    lines[number] = line
+    return ''.join(lines)
+
+
+def test_write_with_current_base(store):
+    plan = store.get()
+    store.write(PLAN + '20:00 | Tea\n', base_version=plan.text_version, base_hash=plan.hash)
+    assert store.get().content.endswith('20:00 | Tea\n')
+    assert store.get().version > plan.version
+
+
+def test_write_on_stale_version_conflicts(store):
+    stale = store.get()
+    store.write(PLAN + '20:00 | Tea\n')
+    with pytest.raises(PlanConflict) as raised:
+        store.write('07:00 | Mine\n', base_version=stale.text_version)
+    assert raised.value.plan.content.endswith('20:00 | Tea\n')
+    assert store.get().content.endswith('20:00 | Tea\n')
+
+
+def test_write_on_stale_hash_conflicts(store):
+    stale = store.get()
+    store.write(PLAN + '20:00 | Tea\n')
+    with pytest.raises(PlanConflict):
+        store.write('07:00 | Mine\n', base_hash=stale.hash)
+
+
+def test_patch_on_current_version(store):
+    base = store.get()
+    ours = replace_line(PLAN, 0, '06:30 | Porridge\n')
+    assert store.patch(delta.make_patch(PLAN, ours), base.text_version) is False
+    assert store.get().content == ours
+
+
+def test_patch_on_stale_version_merges(store):
+    base = store.get()
+    theirs = replace_line(PLAN, 9, '15:30 | Theirs\n')
+    store.write(theirs)
+    ours = replace_line(PLAN, 0, '06:30 | Ours\n')
+    assert store.patch(delta.make_patch(PLAN, ours), base.text_version) is True
+    assert store.get().content == replace_line(theirs, 0, '06:30 | Ours\n')
+
+
+def test_patch_on_stale_version_overlapping_conflicts(store):
+    base = store.get()
+    store.write(replace_line(PLAN, 4, '10:00 | Theirs\n'))
+    ours = replace_line(PLAN, 4, '10:00 | Ours\n')
+    with pytest.raises(PlanConflict) as raised:
+        store.patch(delta.make_patch(PLAN, ours), base.text_version)
+    assert raised.value.conflicts
+    assert '10:00 | Theirs' in store.get().content
+
+
+def test_patch_on_unknown_version_conflicts(store):
+    ours = replace_line(PLAN, 0, '06:30 | Ours\n')
+    with pytest.raises(PlanConflict):
+        store.patch(delta.make_patch(PLAN, ours), 1)
+
+
+def test_patch_that_does_not_fit_is_rejected(store):
+    with pytest.raises(delta.PatchError):
+        store.patch([[50, 60, []]], store.get().text_version)
+
+
+def test_history_survives_restart(store, path):
+    first = store.get()
+    store.write(PLAN + '20:00 | Tea\n')
+    second = store.get()
+
+    restarted = PlanStore(None, path)
+    plan = restarted.get()
+    assert plan.content == second.content
+    # Unchanged text keeps its text version, so saves based on it still apply
+    assert plan.text_version == second.text_version
+    assert plan.version > second.version
+    assert [entry['version'] for entry in restarted.history()] == [second.text_version, first.text_version]
+    assert restarted.content_at(first.text_version) == PLAN
+
+
+def test_torn_history_is_cut_off(store, path):
+    first = store.get()
+    with open(path + '.history', 'ab') as f:
+        f.write(b'{"version": 1, "hash": "x", "cont')
+
+    restarted = PlanStore(None, path)
+    restarted.write(PLAN + '20:00 | Tea\n')
+    second = restarted.get()
+
+    again = PlanStore(None, path)
+    assert [entry['version'] for entry in again.history()] == [second.text_version, first.text_version]
+    assert again.content_at(second.text_version) == PLAN + '20:00 | Tea\n'